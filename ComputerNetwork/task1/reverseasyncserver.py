@@ -0,0 +1,249 @@
+import argparse
+import asyncio
+import os
+import struct
+import time
+
+from reverseprotocol import (CAP_SESSION, CAP_ZLIB, DEFAULT_SPILL_THRESHOLD, FLAG_COMPRESSED, SUPPORTED_CAPS,
+                             PayloadCodec, SpillFile, make_type, split_type)
+from reversemetrics import METRICS, start_metrics_server, start_stats_dump
+
+try:
+    import resource  # 仅类Unix系统提供, 用于调高文件描述符上限
+except ImportError:
+    resource = None
+
+DEFAULT_BACKLOG = 1024
+DEFAULT_MAX_CONNECTIONS = 10000
+
+
+def raise_nofile_limit():
+    '''把进程可打开的文件描述符数提到硬上限, 否则上万个连接会被 ulimit 卡住'''
+    if resource is None:
+        return None
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        target = hard if hard != resource.RLIM_INFINITY else max(soft, 65536)
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+            soft = target
+        except (ValueError, OSError):
+            pass
+    return soft
+
+
+class AsyncReverseServer:
+    '''基于 asyncio 的 reverse 服务端: 一个事件循环 + 非阻塞 socket 处理全部连接, 报文格式与线程版完全一致'''
+
+    def __init__(self, host, port, backlog=DEFAULT_BACKLOG, max_connections=DEFAULT_MAX_CONNECTIONS,
+                 reuse_port=False, spill_threshold=DEFAULT_SPILL_THRESHOLD):
+        self.host = host
+        self.port = port
+        self.backlog = backlog
+        self.max_connections = max_connections
+        self.reuse_port = reuse_port
+        self.spill_threshold = spill_threshold  # 超过该长度的块落盘反转
+
+        self.client_count = 0  # 累计接入的客户端编号
+        self.active_connections = 0  # 当前保持的连接数
+
+    async def handle_client(self, reader, writer):
+        self.client_count += 1
+        num = self.client_count
+        address = writer.get_extra_info('peername')
+        METRICS.connections.inc()
+
+        if self.active_connections >= self.max_connections:
+            METRICS.rejected_connections.inc()
+            print(f"连接数已达上限{self.max_connections}, 拒绝客户端{num}号的连接{address}")
+            writer.close()
+            return
+
+        self.active_connections += 1
+        METRICS.active_connections.inc()
+        print(f"服务器已接受到客户端{num}号的连接请求,客户端信息{address}")
+        try:
+            await self.serve_connection(reader, writer, num)
+        except asyncio.IncompleteReadError:
+            print(f"客户端{num}在传输过程中断开连接!")
+        except ConnectionError as e:
+            print(f"客户端{num}连接异常: {e}")
+        except Exception as e:
+            print(f"处理客户端{num}时发生错误: {e}")
+        finally:
+            self.active_connections -= 1
+            METRICS.active_connections.dec()
+            writer.close()
+            print(f"客户端{num}断开连接!")
+
+    async def serve_connection(self, reader, writer, num):
+        '''与线程版 client_handler 相同的 1/2/3/4 报文交互, 会话模式下一条连接处理多个任务'''
+        jobs = 0
+        while True:
+            try:
+                initialization_data = await reader.readexactly(6)
+            except asyncio.IncompleteReadError as e:
+                if jobs and not e.partial:
+                    return  # 会话模式下客户端在任务之间正常关闭连接
+                if not jobs:
+                    METRICS.handshake_failures.inc(1, 'disconnected')
+                raise
+            packet_type, n_reverse_chunks = struct.unpack('>HI', initialization_data)
+            packet_type, caps = split_type(packet_type)
+
+            if packet_type != 1:
+                METRICS.handshake_failures.inc(1, 'bad_type')
+                print(f"无效的报文类型! 期望1, 实际收到{packet_type}")
+                return
+
+            if n_reverse_chunks <= 0:
+                METRICS.handshake_failures.inc(1, 'bad_chunk_count')
+                print("要做reverse的块数必须是正整数!")
+                return
+
+            # 发送同意报文, 带上双方都支持的能力
+            accepted_caps = caps & SUPPORTED_CAPS
+            codec = PayloadCodec(enabled=bool(accepted_caps & CAP_ZLIB))
+            writer.write(struct.pack('>H', make_type(2, accepted_caps)))
+            await writer.drain()
+            METRICS.bytes_received.inc(6)
+            METRICS.bytes_sent.inc(2)
+
+            if not await self.reverse_chunks(reader, writer, codec, n_reverse_chunks):
+                return
+            jobs += 1
+            METRICS.jobs.inc()
+
+            # 会话模式下继续等待下一个任务, 否则处理完就关闭
+            if not accepted_caps & CAP_SESSION:
+                return
+
+    async def reverse_chunks(self, reader, writer, codec, n_reverse_chunks):
+        '''处理一个任务的n_reverse_chunks个reverseRequest, 全部完成返回True
+
+        耗时统计与线程版相同, 这里的发送耗时是等待 drain 的时间
+        '''
+        for i in range(n_reverse_chunks):
+            request_header = await reader.readexactly(6)
+            start = time.perf_counter()  # 收到请求头才开始计时, 会话中等待下一个请求的空闲时间不计入接收耗时
+            packet_type, len_data = struct.unpack('>HI', request_header)
+            packet_type, flags = split_type(packet_type)
+
+            if packet_type != 3:
+                print(f"无效的报文类型! 期望3, 实际收到{packet_type}")
+                return False
+
+            if len_data > self.spill_threshold:
+                # 超大块: 分段读取写入临时文件(压缩的边收边解压), 不在内存中保存整块
+                spill = SpillFile()
+                try:
+                    decoder = codec.stream_decoder(spill.write, spill.block_size) if flags & FLAG_COMPRESSED else None
+                    remaining = len_data
+                    while remaining > 0:
+                        part = await reader.readexactly(min(spill.block_size, remaining))
+                        remaining -= len(part)
+                        if decoder is not None:
+                            decoder.feed(part)
+                        else:
+                            spill.write(part)
+                    if decoder is not None:
+                        decoder.finish()
+                    received = time.perf_counter()
+                    await self.send_spilled(writer, spill)
+                finally:
+                    spill.close()
+                METRICS.record_chunk(6 + len_data, 6 + spill.length,
+                                     start, received, received, time.perf_counter(), True)
+                continue
+
+            data = await reader.readexactly(len_data)
+            received = time.perf_counter()
+            if codec.raw_length(flags, data) > self.spill_threshold:
+                # 压缩后不大但解压后超过阈值, 同样解压到临时文件
+                spill = SpillFile()
+                try:
+                    decoder = codec.stream_decoder(spill.write, spill.block_size)
+                    decoder.feed(data)
+                    decoder.finish()
+                    reversed_at = time.perf_counter()
+                    await self.send_spilled(writer, spill)
+                finally:
+                    spill.close()
+                METRICS.record_chunk(6 + len_data, 6 + spill.length,
+                                     start, received, reversed_at, time.perf_counter(), True)
+                continue
+            data = codec.decode(flags, data)
+
+            # 反转数据并发送响应, writelines 把报文头和数据一起交给传输层, 不做拼接
+            # 传输层可能暂存未发完的数据, 所以这里不复用反转缓冲区; drain 保证慢客户端不会让发送缓冲无限增长
+            flags, reversed_data = codec.encode(data[::-1])
+            reversed_at = time.perf_counter()
+            writer.writelines([struct.pack('>HI', make_type(4, flags), len(reversed_data)), reversed_data])
+            await writer.drain()
+            METRICS.record_chunk(6 + len_data, 6 + len(reversed_data),
+                                 start, received, reversed_at, time.perf_counter())
+        return True
+
+    async def send_spilled(self, writer, spill):
+        '''从文件末尾往前逐块发送反转后的数据, 每块发完等待drain, 发送缓冲不超过一块'''
+        writer.write(struct.pack('>HI', 4, spill.length))
+        for block in spill.reversed_blocks():
+            writer.write(bytes(block))  # 反转缓冲区会被复用, 交给传输层前先拷贝
+            await writer.drain()
+
+    async def serve_forever(self):
+        server = await asyncio.start_server(self.handle_client, self.host, self.port,
+                                            backlog=self.backlog, reuse_port=self.reuse_port)
+        print(f"服务端(asyncio)已启动! ip地址: {self.host} 端口号:{self.port} 进程号:{os.getpid()}")
+        print(f"backlog: {self.backlog}, 最大连接数: {self.max_connections}, 落盘阈值: {self.spill_threshold}字节")
+        print(f"正在等待客户端连接......")
+        async with server:
+            await server.serve_forever()
+
+
+def run_server(host, port, backlog=DEFAULT_BACKLOG, max_connections=DEFAULT_MAX_CONNECTIONS, reuse_port=False,
+               spill_threshold=DEFAULT_SPILL_THRESHOLD, metrics_port=None, stats_interval=None):
+    '''在当前进程中运行一个事件循环; 指标接口和统计输出在后台线程中, 不占用事件循环'''
+    if metrics_port:
+        start_metrics_server(metrics_port)
+    if stats_interval:
+        start_stats_dump(stats_interval)
+    limit = raise_nofile_limit()
+    if limit is not None and limit < max_connections:
+        print(f"警告: 文件描述符上限为{limit}, 小于最大连接数{max_connections}")
+    server = AsyncReverseServer(host, port, backlog, max_connections, reuse_port, spill_threshold)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="asyncio 版 reverse 服务端")
+    parser.add_argument('host', nargs='?', default="127.0.0.1")
+    parser.add_argument('port', nargs='?', type=int, default=6666)
+    parser.add_argument('--backlog', type=int, default=DEFAULT_BACKLOG, help="listen 队列长度")
+    parser.add_argument('--max-conn', type=int, default=DEFAULT_MAX_CONNECTIONS, help="同时保持的最大连接数")
+    parser.add_argument('--workers', type=int, default=1, help="事件循环进程数, 一般设为CPU核数")
+    parser.add_argument('--spill-threshold', type=int, default=DEFAULT_SPILL_THRESHOLD,
+                        help="超过该字节数的块落盘反转, 限制每个连接的内存占用")
+    parser.add_argument('--metrics-port', type=int,
+                        help="在该端口提供 Prometheus 文本格式的 /metrics 接口, 多进程时第i个进程使用该端口+i")
+    parser.add_argument('--stats-interval', type=float, help="每隔多少秒打印一行统计摘要")
+    args = parser.parse_args()
+    if args.backlog <= 0 or args.max_conn <= 0 or args.workers <= 0 or args.spill_threshold <= 0:
+        parser.error("backlog、max-conn、workers 和 spill-threshold 必须是正整数!")
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.workers == 1:
+        run_server(args.host, args.port, args.backlog, args.max_conn, spill_threshold=args.spill_threshold,
+                   metrics_port=args.metrics_port, stats_interval=args.stats_interval)
+    else:
+        # 每个核一个进程、每个进程一个事件循环, 由监督进程负责启动和重启
+        from reverseservercluster import ServerSupervisor
+        ServerSupervisor(args.host, args.port, args.workers, 'async', args.backlog, args.max_conn,
+                         spill_threshold=args.spill_threshold, metrics_port=args.metrics_port,
+                         stats_interval=args.stats_interval).run()
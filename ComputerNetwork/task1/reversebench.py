@@ -0,0 +1,192 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+from reverseprotocol import AGREE, HEADER, HEADER_SIZE
+
+ENGINES = {
+    'thread': 'reversetcpserver.py',
+    'async': 'reverseasyncserver.py',
+    'cluster': 'reverseservercluster.py',
+}
+
+
+def percentile(sorted_values, p):
+    '''最近秩法求百分位数, sorted_values 需已排序'''
+    if not sorted_values:
+        return None
+    k = max(0, math.ceil(p / 100 * len(sorted_values)) - 1)
+    return sorted_values[k]
+
+
+def make_payload(size, seed):
+    '''生成测试数据, 同一seed得到相同内容'''
+    rng = random.Random(seed)
+    return rng.randbytes(size)
+
+
+def plan_sizes(total_len, Lmin, Lmax, rng):
+    '''与客户端相同的随机分块规则'''
+    sizes = []
+    current = 0
+    while current < total_len:
+        remaining = total_len - current
+        size = remaining if remaining < Lmin else rng.randint(Lmin, min(Lmax, remaining))
+        sizes.append(size)
+        current += size
+    return sizes
+
+
+async def run_client(host, port, payload, Lmin, Lmax, rng, latencies, stats, verify):
+    '''模拟一个客户端: 完成一次 1/2/3/4 报文交互, 记录每块的往返时延'''
+    sizes = plan_sizes(len(payload), Lmin, Lmax, rng)
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(HEADER.pack(1, len(sizes)))
+        await writer.drain()
+        packet_type, = AGREE.unpack(await reader.readexactly(AGREE.size))
+        if packet_type != 2:
+            raise ValueError(f"期望收到报文类型2, 实际收到{packet_type}")
+
+        offset = 0
+        for size in sizes:
+            chunk = payload[offset: offset + size]
+            offset += size
+            start = time.perf_counter()
+            writer.write(HEADER.pack(3, size))
+            writer.write(chunk)
+            await writer.drain()
+            answer_type, answer_length = HEADER.unpack(await reader.readexactly(HEADER_SIZE))
+            data = await reader.readexactly(answer_length)
+            latencies.append(time.perf_counter() - start)
+            if answer_type != 4 or answer_length != size:
+                raise ValueError(f"应答报文错误: 类型{answer_type}, 长度{answer_length}")
+            if verify and data != chunk[::-1]:
+                raise ValueError("反转结果不正确")
+            stats['requests'] += 1
+            stats['bytes'] += size
+    finally:
+        writer.close()
+
+
+async def run_load(host, port, clients, concurrency, file_size, Lmin, Lmax, seed, verify):
+    payload = make_payload(file_size, seed)
+    latencies = []
+    stats = {'requests': 0, 'bytes': 0, 'errors': 0}
+    limit = asyncio.Semaphore(concurrency)
+
+    async def one_client(k):
+        async with limit:
+            try:
+                rng = random.Random(seed * 1000003 + k)  # 每个客户端的分块方式固定
+                await run_client(host, port, payload, Lmin, Lmax, rng, latencies, stats, verify)
+            except (OSError, ValueError, asyncio.IncompleteReadError) as e:
+                stats['errors'] += 1
+                if stats['errors'] <= 5:
+                    print(f"客户端{k}出错: {e}", file=sys.stderr)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one_client(k) for k in range(clients)))
+    elapsed = time.perf_counter() - start
+    return elapsed, latencies, stats
+
+
+def wait_for_port(host, port, timeout=10.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def start_server(engine, host, port, extra_args):
+    '''以子进程方式启动本地服务端'''
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    cmd = [sys.executable, os.path.join(script_dir, ENGINES[engine]), host, str(port)] + extra_args
+    return subprocess.Popen(cmd, cwd=script_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def benchmark(args):
+    server = None
+    if args.engine != 'external':
+        server = start_server(args.engine, args.host, args.port, args.server_args)
+        if not wait_for_port(args.host, args.port):
+            server.kill()
+            raise SystemExit("服务端启动失败")
+    try:
+        elapsed, latencies, stats = asyncio.run(
+            run_load(args.host, args.port, args.clients, args.concurrency, args.file_size, args.Lmin, args.Lmax,
+                     args.seed, not args.no_verify))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    latencies.sort()
+
+    def to_ms(v):
+        return None if v is None else round(v * 1000, 3)
+
+    return {
+        'engine': args.engine,
+        'clients': args.clients,
+        'concurrency': args.concurrency,
+        'file_size': args.file_size,
+        'Lmin': args.Lmin,
+        'Lmax': args.Lmax,
+        'seed': args.seed,
+        'elapsed_s': round(elapsed, 4),
+        'requests': stats['requests'],
+        'errors': stats['errors'],
+        'bytes': stats['bytes'],
+        'requests_per_s': round(stats['requests'] / elapsed, 2) if elapsed else None,
+        'mb_per_s': round(stats['bytes'] / elapsed / 1e6, 3) if elapsed else None,
+        'latency_ms': {
+            'p50': to_ms(percentile(latencies, 50)),
+            'p99': to_ms(percentile(latencies, 99)),
+            'p999': to_ms(percentile(latencies, 99.9)),
+            'max': to_ms(latencies[-1] if latencies else None),
+        },
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="reverse 服务的压测工具, 结果以 JSON 输出")
+    parser.add_argument('--engine', choices=list(ENGINES) + ['external'], default='thread',
+                        help="启动哪种本地服务端; external 表示压测已在运行的服务端")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6666)
+    parser.add_argument('--clients', type=int, default=100, help="模拟的客户端总数, 每个客户端传输一个文件")
+    parser.add_argument('--concurrency', type=int, default=20, help="同时在线的客户端数")
+    parser.add_argument('--file-size', type=int, default=64 * 1024, help="每个客户端的文件大小(字节)")
+    parser.add_argument('--Lmin', type=int, default=512)
+    parser.add_argument('--Lmax', type=int, default=4096)
+    parser.add_argument('--seed', type=int, default=1, help="随机种子, 固定后每次运行的负载相同")
+    parser.add_argument('--no-verify', action='store_true', help="不校验反转结果")
+    parser.add_argument('--output', help="把 JSON 结果追加写入该文件(每行一条)")
+    parser.add_argument('--server-args', nargs=argparse.REMAINDER, default=[],
+                        help="透传给服务端的参数, 如 --server-args --workers 4")
+    args = parser.parse_args()
+    if min(args.clients, args.concurrency, args.file_size, args.Lmin, args.Lmax) <= 0 or args.Lmin > args.Lmax:
+        parser.error("参数必须是正整数且 Lmin <= Lmax!")
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    result = benchmark(args)
+    line = json.dumps(result, ensure_ascii=False)
+    print(line)
+    if args.output:
+        with open(args.output, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
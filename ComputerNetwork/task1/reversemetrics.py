@@ -0,0 +1,191 @@
+import bisect
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 单块耗时的直方图分桶(秒)
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+def format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+
+
+class Counter:
+    '''只增不减的计数器, 可带标签'''
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, *labels):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self.values.get(labels, 0)
+
+    def samples(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        if not items and not self.labelnames:
+            items = [((), 0)]
+        for labels, value in items:
+            yield self.name + format_labels(self.labelnames, labels), value
+
+
+class Gauge(Counter):
+    '''可增可减的当前值, 如活动连接数'''
+    kind = 'gauge'
+
+    def dec(self, amount=1, *labels):
+        self.inc(-amount, *labels)
+
+    def set(self, value, *labels):
+        with self.lock:
+            self.values[labels] = value
+
+
+class Histogram:
+    '''累积分桶直方图, 与 Prometheus 的 histogram 类型一致'''
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # 最后一个是 +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def samples(self):
+        with self.lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+        cumulative = 0
+        for bound, n in zip(self.buckets + (float('inf'),), counts):
+            cumulative += n
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            yield f'{self.name}_bucket{{le="{le}"}}', cumulative
+        yield f'{self.name}_sum', total
+        yield f'{self.name}_count', count
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        '''按 Prometheus 文本格式输出所有指标'''
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, value in metric.samples():
+                lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+class ServerMetrics:
+    '''reverse 服务端的全部指标'''
+
+    def __init__(self):
+        self.registry = Registry()
+        r = self.registry.register
+        self.active_connections = r(Gauge('reverse_active_connections', '当前保持的连接数'))
+        self.connections = r(Counter('reverse_connections_total', '累计接受的连接数'))
+        self.rejected_connections = r(Counter('reverse_rejected_connections_total', '因连接数上限被拒绝的连接数'))
+        self.bytes_received = r(Counter('reverse_received_bytes_total', '收到的报文字节数'))
+        self.bytes_sent = r(Counter('reverse_sent_bytes_total', '发出的报文字节数'))
+        self.jobs = r(Counter('reverse_jobs_total', '完成的反转任务数'))
+        self.chunks = r(Counter('reverse_chunks_total', '完成反转的块数'))
+        self.spilled_chunks = r(Counter('reverse_spilled_chunks_total', '落盘反转的块数'))
+        self.handshake_failures = r(Counter('reverse_handshake_failures_total', '握手失败次数', ('reason',)))
+        self.receive_seconds = r(Histogram('reverse_chunk_receive_seconds', '接收一个块的耗时'))
+        self.reverse_seconds = r(Histogram('reverse_chunk_reverse_seconds', '解码、反转、编码一个块的耗时'))
+        self.send_seconds = r(Histogram('reverse_chunk_send_seconds', '发送一个块应答的耗时'))
+
+    def record_chunk(self, received_bytes, sent_bytes, start, received, reversed_at, sent, spilled=False):
+        '''记录一块的收发字节数和 接收/反转/发送 三段耗时, 时间点都取自 time.perf_counter'''
+        self.chunks.inc()
+        if spilled:
+            self.spilled_chunks.inc()
+        self.bytes_received.inc(received_bytes)
+        self.bytes_sent.inc(sent_bytes)
+        self.receive_seconds.observe(received - start)
+        self.reverse_seconds.observe(reversed_at - received)
+        self.send_seconds.observe(sent - reversed_at)
+
+    def render(self):
+        return self.registry.render()
+
+    def summary(self):
+        '''周期性打印用的一行摘要'''
+        def avg_ms(h):
+            return h.sum / h.count * 1000 if h.count else 0.0
+        return (f"活动连接 {self.active_connections.value()}, 累计连接 {self.connections.value()}, "
+                f"块 {self.chunks.value()}, 收 {self.bytes_received.value()}B, 发 {self.bytes_sent.value()}B, "
+                f"平均耗时 接收{avg_ms(self.receive_seconds):.3f}ms/反转{avg_ms(self.reverse_seconds):.3f}ms/"
+                f"发送{avg_ms(self.send_seconds):.3f}ms")
+
+
+# 进程内共享的一份指标, 服务端各处直接使用
+METRICS = ServerMetrics()
+
+
+def start_metrics_server(port, host='127.0.0.1', metrics=METRICS):
+    '''在后台线程中提供 http://host:port/metrics 文本接口'''
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in ('/metrics', '/'):
+                self.send_error(404)
+                return
+            body = metrics.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # 不把每次抓取都打印出来
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    print(f"指标接口已启动: http://{host}:{port}/metrics")
+    return server
+
+
+def start_stats_dump(interval, metrics=METRICS, file=None):
+    '''每隔interval秒打印一行指标摘要'''
+
+    def dump():
+        while True:
+            time.sleep(interval)
+            print(f"[{time.strftime('%H:%M:%S')}] {metrics.summary()}", file=file or sys.stdout, flush=True)
+
+    thread = threading.Thread(target=dump, name='stats-dump', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,262 @@
+import mmap
+import struct
+import tempfile
+import zlib
+
+# 报文头: 类型(H) + 块数/数据长度(I), 大端
+HEADER = struct.Struct('>HI')
+HEADER_SIZE = HEADER.size
+# agree报文只有类型字段
+AGREE = struct.Struct('>H')
+
+DEFAULT_BUFFER_SIZE = 64 * 1024
+# 超过该长度的块不在内存中反转, 而是落盘到临时文件后按块倒序发送
+DEFAULT_SPILL_THRESHOLD = 16 * 1024 * 1024
+DEFAULT_SPILL_BLOCK_SIZE = 1024 * 1024
+
+# 类型字段的低8位是报文类型, 高8位是标志位:
+#   初始化报文(1)的高8位是客户端请求的能力, agree报文(2)的高8位是服务端同意的能力
+#   reverseRequest(3)/reverseAnswer(4)的高8位表示该块数据的编码方式
+# 旧版客户端标志位全为0, 收到的agree报文也就是原来的2, 报文格式完全兼容
+TYPE_MASK = 0x00FF
+CAP_ZLIB = 0x01  # 能力: 支持zlib压缩数据
+CAP_SESSION = 0x02  # 能力: 一个任务完成后连接不关闭, 可以继续发送下一个初始化报文
+SUPPORTED_CAPS = CAP_ZLIB | CAP_SESSION
+FLAG_COMPRESSED = 0x01  # 数据已压缩: 4字节原始长度 + zlib数据
+
+RAW_LEN = struct.Struct('>I')
+DEFAULT_COMPRESS_THRESHOLD = 512  # 小于该长度的块不压缩
+DEFAULT_COMPRESS_LEVEL = 1
+
+
+def make_type(packet_type, flags=0):
+    '''组合报文类型和标志位'''
+    return packet_type | (flags << 8)
+
+
+def split_type(value):
+    '''拆分出(报文类型, 标志位)'''
+    return value & TYPE_MASK, value >> 8
+
+
+class PayloadCodec:
+    '''握手协商出的数据编码方式: enabled 为 False 时原样收发, 为 True 时超过阈值的块用zlib压缩'''
+
+    def __init__(self, enabled=False, threshold=DEFAULT_COMPRESS_THRESHOLD, level=DEFAULT_COMPRESS_LEVEL):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.level = level
+
+    def encode(self, data):
+        '''返回(标志位, 要发送的数据); 压缩后没有变小的块原样发送'''
+        if not self.enabled or len(data) < self.threshold:
+            return 0, data
+        compressed = zlib.compress(data, self.level)
+        if len(compressed) + RAW_LEN.size >= len(data):
+            return 0, data
+        return FLAG_COMPRESSED, RAW_LEN.pack(len(data)) + compressed
+
+    @staticmethod
+    def raw_length(flags, payload):
+        '''数据还原后的长度, 压缩数据取4字节长度前缀'''
+        if not flags & FLAG_COMPRESSED:
+            return len(payload)
+        if len(payload) < RAW_LEN.size:
+            raise ValueError("压缩数据格式错误")
+        return RAW_LEN.unpack(payload[:RAW_LEN.size])[0]
+
+    def stream_decoder(self, write, block_size=DEFAULT_SPILL_BLOCK_SIZE):
+        '''分段解压超大的压缩块, 见 StreamDecoder'''
+        if not self.enabled:
+            raise ValueError("未协商压缩却收到了压缩数据")
+        return StreamDecoder(write, block_size)
+
+    def decode(self, flags, payload):
+        '''按标志位还原数据, 数据不合法时抛出 ValueError'''
+        if not flags & FLAG_COMPRESSED:
+            return payload
+        if not self.enabled:
+            raise ValueError("未协商压缩却收到了压缩数据")
+        if len(payload) < RAW_LEN.size:
+            raise ValueError("压缩数据格式错误")
+        raw_len, = RAW_LEN.unpack(payload[:RAW_LEN.size])
+        decompressor = zlib.decompressobj()
+        try:
+            # 最多解压出声明的长度, 防止压缩炸弹
+            data = decompressor.decompress(payload[RAW_LEN.size:], raw_len)
+        except zlib.error as e:
+            raise ValueError(f"解压失败: {e}")
+        if len(data) != raw_len or not decompressor.eof:
+            raise ValueError("解压后长度与声明不符")
+        return data
+
+
+def recv_exact_into(sock, view):
+    '''用 recv_into 把数据直接读满view, 对端断开返回False'''
+    received = 0
+    total = len(view)
+    while received < total:
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            return False
+        received += n
+    return True
+
+
+class FramedReader:
+    '''按报文读取TCP字节流: 报文头和数据直接 recv_into 预分配的缓冲区, 同一连接内反复复用'''
+
+    def __init__(self, sock, buffer_size=DEFAULT_BUFFER_SIZE):
+        self.sock = sock
+        self.header = bytearray(HEADER_SIZE)
+        self.header_view = memoryview(self.header)
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+
+    def read_header(self):
+        '''读取6字节报文头, 返回(类型, 长度), 连接断开返回None'''
+        if not recv_exact_into(self.sock, self.header_view):
+            return None
+        return HEADER.unpack(self.header)
+
+    def read_agree(self):
+        '''读取2字节的agree报文, 返回报文类型, 连接断开返回None'''
+        view = self.header_view[:AGREE.size]
+        if not recv_exact_into(self.sock, view):
+            return None
+        return AGREE.unpack(view)[0]
+
+    def read_payload(self, length):
+        '''读取length字节数据, 返回指向内部缓冲区的memoryview, 只在下一次读取之前有效
+
+        缓冲区不够时按需扩容一次, 之后同样大小的块不再分配内存
+        '''
+        if length > len(self.buffer):
+            self.buffer = bytearray(length)
+            self.view = memoryview(self.buffer)
+        view = self.view[:length]
+        if not recv_exact_into(self.sock, view):
+            return None
+        return view
+
+
+def send_frame(sock, packet_type, payload):
+    '''发送一个 报文头+数据 的报文
+
+    支持 sendmsg 的平台上把报文头和数据作为两个缓冲区一次交给内核(向量I/O), 不再为了拼接6字节报文头拷贝整块数据;
+    不支持时(Windows)退回拼接后 sendall, 避免分两次发送被 Nagle 算法拖慢
+    '''
+    header = HEADER.pack(packet_type, len(payload))
+    if not hasattr(sock, 'sendmsg'):
+        sock.sendall(header + bytes(payload))
+        return
+    buffers = [memoryview(header), memoryview(payload)]
+    while buffers:
+        sent = sock.sendmsg(buffers)
+        # 去掉已经发完的部分, 继续发送剩余数据
+        while buffers and sent >= len(buffers[0]):
+            sent -= len(buffers[0])
+            buffers.pop(0)
+        if sent:
+            buffers[0] = buffers[0][sent:]
+
+
+class Reverser:
+    '''把数据反转写入一个复用的输出缓冲区, 每块只拷贝一次'''
+
+    def __init__(self, buffer_size=DEFAULT_BUFFER_SIZE):
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+
+    def reverse(self, data):
+        '''返回指向输出缓冲区的memoryview, 只在下一次反转之前有效'''
+        length = len(data)
+        if length > len(self.buffer):
+            self.buffer = bytearray(length)
+            self.view = memoryview(self.buffer)
+        out = self.view[:length]
+        out[:] = memoryview(data)[::-1]
+        return out
+
+
+class StreamDecoder:
+    '''分段解压一个压缩块: 每次最多解压出block_size字节交给write, 不会一次性在内存中还原整块'''
+
+    def __init__(self, write, block_size=DEFAULT_SPILL_BLOCK_SIZE):
+        self.write = write
+        self.block_size = block_size
+        self.prefix = b''
+        self.raw_len = None
+        self.decoded = 0
+        self.decompressor = zlib.decompressobj()
+
+    def feed(self, part):
+        if self.raw_len is None:
+            # 先凑齐4字节原始长度
+            need = RAW_LEN.size - len(self.prefix)
+            self.prefix += bytes(part[:need])
+            part = part[need:]
+            if len(self.prefix) < RAW_LEN.size:
+                return
+            self.raw_len, = RAW_LEN.unpack(self.prefix)
+        try:
+            data = self.decompressor.decompress(part, self.block_size)
+            while True:
+                self.decoded += len(data)
+                if self.decoded > self.raw_len:
+                    raise ValueError("解压后长度与声明不符")
+                if data:
+                    self.write(data)
+                if not self.decompressor.unconsumed_tail:
+                    break
+                data = self.decompressor.decompress(self.decompressor.unconsumed_tail, self.block_size)
+        except zlib.error as e:
+            raise ValueError(f"解压失败: {e}")
+
+    def finish(self):
+        '''数据全部送入后检查完整性, 返回还原后的长度'''
+        if self.raw_len is None or self.decoded != self.raw_len or not self.decompressor.eof:
+            raise ValueError("解压后长度与声明不符")
+        return self.decoded
+
+
+class SpillFile:
+    '''超大块的落盘反转: 收到的数据顺序写入临时文件, 再 mmap 后从尾到头按固定大小反转发送
+
+    无论块多大, 内存中只有一个 block_size 大小的反转缓冲区
+    '''
+
+    def __init__(self, block_size=DEFAULT_SPILL_BLOCK_SIZE):
+        self.file = tempfile.TemporaryFile()
+        self.length = 0
+        self.block_size = block_size
+        self.block = bytearray(block_size)
+
+    def write(self, data):
+        self.file.write(data)
+        self.length += len(data)
+
+    def reversed_blocks(self):
+        '''从文件末尾往前, 逐块产生反转后的数据, 产生的memoryview只在下一块之前有效'''
+        if self.length == 0:
+            return
+        self.file.flush()
+        with mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            view = memoryview(mm)
+            out = memoryview(self.block)
+            try:
+                end = self.length
+                while end > 0:
+                    start = max(0, end - self.block_size)
+                    out[:end - start] = view[start:end][::-1]
+                    yield out[:end - start]
+                    if hasattr(mm, 'madvise'):
+                        # 已经发送过的页面不再需要, 让它们退出常驻内存
+                        page_start = start - start % mmap.PAGESIZE
+                        mm.madvise(mmap.MADV_DONTNEED, page_start, end - page_start)
+                    end = start
+            finally:
+                view.release()
+
+    def close(self):
+        self.file.close()
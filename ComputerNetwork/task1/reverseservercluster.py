@@ -0,0 +1,136 @@
+import argparse
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+from reverseasyncserver import DEFAULT_BACKLOG, DEFAULT_MAX_CONNECTIONS, run_server
+from reverseprotocol import DEFAULT_SPILL_THRESHOLD
+from reversetcpserver import bind_server_socket, serve_forever, start_monitoring
+
+
+def worker_main(engine, host, port, backlog, max_connections, spill_threshold, metrics_port=None, stats_interval=None):
+    '''工作进程: 用 SO_REUSEPORT 绑定同一端口, 运行原有的报文交互逻辑
+
+    指标是进程内的, 每个工作进程在各自的 metrics_port 上提供接口
+    '''
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)  # 不继承监督进程的SIGTERM处理, 保证terminate能结束工作进程
+    try:
+        if engine == 'thread':
+            server_socket = bind_server_socket(host, port, backlog, reuse_port=True)
+            print(f"工作进程{os.getpid()}已启动(线程版), 端口号:{port}")
+            start_monitoring(metrics_port, stats_interval)
+            serve_forever(server_socket, spill_threshold)
+        else:
+            run_server(host, port, backlog, max_connections, reuse_port=True, spill_threshold=spill_threshold,
+                       metrics_port=metrics_port, stats_interval=stats_interval)
+    except KeyboardInterrupt:
+        pass
+
+
+class ServerSupervisor:
+    '''启动N个工作进程共享同一端口, 工作进程意外退出时自动重启'''
+
+    def __init__(self, host, port, workers, engine='thread', backlog=DEFAULT_BACKLOG,
+                 max_connections=DEFAULT_MAX_CONNECTIONS, check_interval=0.5, max_restart_delay=30.0,
+                 spill_threshold=DEFAULT_SPILL_THRESHOLD, metrics_port=None, stats_interval=None):
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.engine = engine
+        self.backlog = backlog
+        self.max_connections = max_connections
+        self.check_interval = check_interval
+        self.max_restart_delay = max_restart_delay
+        self.spill_threshold = spill_threshold
+        self.metrics_port = metrics_port  # 第i个工作进程的指标接口端口为 metrics_port+i
+        self.stats_interval = stats_interval
+
+        self.processes = [None] * workers
+        self.started_at = [0.0] * workers
+        self.restart_delay = [0.0] * workers  # 频繁崩溃时逐步退避, 避免疯狂重启
+        self.next_start = [0.0] * workers
+        self.running = False
+
+    def start_worker(self, index):
+        metrics_port = self.metrics_port + index if self.metrics_port else None
+        p = multiprocessing.Process(target=worker_main, name=f"reverse-worker-{index}",
+                                    args=(self.engine, self.host, self.port, self.backlog, self.max_connections,
+                                          self.spill_threshold, metrics_port, self.stats_interval))
+        p.daemon = True
+        p.start()
+        self.processes[index] = p
+        self.started_at[index] = time.time()
+
+    def check_workers(self):
+        now = time.time()
+        for index, p in enumerate(self.processes):
+            if p is not None and p.is_alive():
+                # 稳定运行一段时间后清零退避
+                if self.restart_delay[index] and now - self.started_at[index] > self.max_restart_delay:
+                    self.restart_delay[index] = 0.0
+                continue
+            if p is not None:
+                print(f"工作进程{index}(pid {p.pid})退出, 退出码{p.exitcode}")
+                p.join()
+                self.processes[index] = None
+                self.restart_delay[index] = min(self.max_restart_delay, max(0.5, self.restart_delay[index] * 2))
+                self.next_start[index] = now + self.restart_delay[index]
+                print(f"{self.restart_delay[index]:.1f}秒后重启工作进程{index}")
+            elif now >= self.next_start[index]:
+                self.start_worker(index)
+
+    def stop(self, *args):
+        self.running = False
+
+    def run(self):
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            print("当前系统不支持 SO_REUSEPORT, 无法启动多进程服务端")
+            return
+        signal.signal(signal.SIGTERM, self.stop)
+        print(f"服务端已启动! ip地址: {self.host} 端口号:{self.port} 工作进程数:{self.workers} 引擎:{self.engine}")
+        self.running = True
+        for index in range(self.workers):
+            self.start_worker(index)
+        try:
+            while self.running:
+                time.sleep(self.check_interval)
+                if self.running:
+                    self.check_workers()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            print("\n服务器关闭中...")
+            for p in self.processes:
+                if p is not None and p.is_alive():
+                    p.terminate()
+            for p in self.processes:
+                if p is not None:
+                    p.join()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="多进程 reverse 服务端, 各进程通过 SO_REUSEPORT 共享端口")
+    parser.add_argument('host', nargs='?', default="127.0.0.1")
+    parser.add_argument('port', nargs='?', type=int, default=6666)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="工作进程数, 默认等于CPU核数")
+    parser.add_argument('--engine', choices=['thread', 'async'], default='thread',
+                        help="工作进程内的服务端实现: thread 每连接一个线程, async 单事件循环")
+    parser.add_argument('--backlog', type=int, default=DEFAULT_BACKLOG, help="listen 队列长度")
+    parser.add_argument('--max-conn', type=int, default=DEFAULT_MAX_CONNECTIONS, help="async 引擎每个进程的最大连接数")
+    parser.add_argument('--spill-threshold', type=int, default=DEFAULT_SPILL_THRESHOLD,
+                        help="超过该字节数的块落盘反转, 限制每个连接的内存占用")
+    parser.add_argument('--metrics-port', type=int, help="第i个工作进程在该端口+i上提供 /metrics 接口")
+    parser.add_argument('--stats-interval', type=float, help="每个工作进程每隔多少秒打印一行统计摘要")
+    args = parser.parse_args()
+    if args.workers <= 0 or args.backlog <= 0 or args.max_conn <= 0 or args.spill_threshold <= 0:
+        parser.error("workers、backlog、max-conn 和 spill-threshold 必须是正整数!")
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    ServerSupervisor(args.host, args.port, args.workers, args.engine, args.backlog, args.max_conn,
+                     spill_threshold=args.spill_threshold, metrics_port=args.metrics_port,
+                     stats_interval=args.stats_interval).run()
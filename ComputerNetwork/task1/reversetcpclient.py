@@ -1,13 +1,66 @@
+import contextlib
+import mmap
+import os
 import socket
-import struct
 import random
 import sys
+import threading
+
+from reverseprotocol import (AGREE, CAP_SESSION, CAP_ZLIB, DEFAULT_COMPRESS_THRESHOLD, HEADER, FramedReader,
+                             PayloadCodec, make_type, recv_exact_into, send_frame, split_type)
+
+
+USAGE = ("请正确输入参数: python reversetcpclient.py <server_address> <server_port> <data_file_path> <Lmin> <Lmax>"
+         " [--pipeline K] [--stream] [--connections N] [--compress] [--compress-threshold N]")
+
+# 可选参数及默认值
+DEFAULT_OPTIONS = {
+    'pipeline': 1,  # 同时在途的reverseRequest个数, 1即发一个等一个
+    'stream': False,  # 流式模式: mmap读入文件, 结果按偏移直接写入输出文件
+    'connections': 1,  # 并行连接数, 每条连接负责一段连续的块
+    'compress': False,  # 握手时请求zlib压缩
+    'compress-threshold': DEFAULT_COMPRESS_THRESHOLD,  # 小于该长度的块不压缩
+}
+# 不带取值的开关参数
+FLAG_OPTIONS = {'stream', 'compress'}
+
+OUTPUT_FILE = 'output.txt'
+
+
+def parse_options(args):
+    '''解析形如 --name value 的可选参数以及 --flag 开关'''
+    options = dict(DEFAULT_OPTIONS)
+    i = 0
+    while i < len(args):
+        name = args[i]
+        key = name[2:]
+        if not name.startswith('--') or key not in options:
+            print(f"未知参数: {name}")
+            print(USAGE)
+            sys.exit(1)
+        if key in FLAG_OPTIONS:
+            options[key] = True
+            i += 1
+            continue
+        if i + 1 >= len(args):
+            print(f"参数{name}缺少取值!")
+            print(USAGE)
+            sys.exit(1)
+        try:
+            options[key] = int(args[i + 1])
+        except ValueError:
+            print(f"参数{name}必须是整数!")
+            sys.exit(1)
+        i += 2
+    if options['pipeline'] <= 0 or options['connections'] <= 0 or options['compress-threshold'] < 0:
+        print("pipeline和connections必须是正整数, compress-threshold不能为负数!")
+        sys.exit(1)
+    return options
 
 
 def input_check():
-    if len(sys.argv) != 6:
-        print(
-            "请正确输入参数: python reversetcpclient.py <server_address> <server_port> <data_file_path> <Lmin> <Lmax>")
+    if len(sys.argv) < 6:
+        print(USAGE)
         sys.exit(1)
 
     server_address = sys.argv[1]
@@ -18,7 +71,8 @@ def input_check():
     if Lmin <= 0 or Lmax <= 0 or Lmin > Lmax:
         print("请输入合法的Lmin和Lmax!")
         sys.exit(1)  # 修正：错误时应退出程序
-    return server_address, server_port, data_file_path, Lmin, Lmax
+    options = parse_options(sys.argv[6:])
+    return server_address, server_port, data_file_path, Lmin, Lmax, options
 
 
 def get_data_from_file(file_path):
@@ -55,87 +109,483 @@ def spilt_chunks(data, Lmin, Lmax):
     return data_chunks
 
 
-def create_client():
+def plan_chunks(total_len, Lmin, Lmax, seed):
+    '''按与spilt_chunks相同的规则随机分块, 只产生(偏移, 长度); 同一个seed重复调用得到相同的分块'''
+    rng = random.Random(seed)
+    current = 0
+    while current < total_len:
+        remaining = total_len - current
+        if remaining < Lmin:
+            chunk_size = remaining
+        else:
+            chunk_size = rng.randint(Lmin, min(Lmax, remaining))
+        yield current, chunk_size
+        current += chunk_size
+
+
+class MmapChunkSource:
+    '''流式读取输入文件: mmap 整个文件, 按块产生 memoryview, 不把文件读入内存'''
+
+    def __init__(self, file_path, Lmin, Lmax):
+        try:
+            self.file = open(file_path, 'rb')
+            self.total_len = os.fstat(self.file.fileno()).st_size
+        except OSError as e:
+            print(f"读取文件错误: {e}")
+            sys.exit(1)
+        if self.total_len == 0:
+            self.file.close()
+            print("错误：输入文件为空")
+            sys.exit(1)
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mm)
+        self.Lmin = Lmin
+        self.Lmax = Lmax
+        # 先用固定seed数一遍块数(初始化报文需要), 发送时再用同一seed重新生成, 内存占用与块数无关
+        self.seed = random.getrandbits(64)
+        self.n_chunks = sum(1 for _ in plan_chunks(self.total_len, Lmin, Lmax, self.seed))
+        self.iterators = []
+
+    def __len__(self):
+        return self.n_chunks
+
+    def __iter__(self):
+        return self.chunk_range(0, self.n_chunks)
+
+    def chunk_sizes(self):
+        for offset, size in plan_chunks(self.total_len, self.Lmin, self.Lmax, self.seed):
+            yield size
+
+    def chunk_range(self, first, count):
+        '''产生第first块起的count个块'''
+        iterator = self._chunk_range(first, count)
+        self.iterators.append(iterator)
+        return iterator
+
+    def _chunk_range(self, first, count):
+        for i, (offset, size) in enumerate(plan_chunks(self.total_len, self.Lmin, self.Lmax, self.seed)):
+            if i >= first + count:
+                break
+            if i < first:
+                continue
+            with self.view[offset: offset + size] as chunk:  # 块用完立即释放, 否则mmap无法关闭
+                yield chunk
+
+    def close(self):
+        for iterator in self.iterators:
+            iterator.close()
+        self.view.release()
+        self.mm.close()
+        self.file.close()
+
+
+class OffsetWriter:
+    '''预先把输出文件扩到最终大小, 每个反转块直接写到它的最终偏移处
+
+    先写到同目录下的临时文件, close(ok=True) 时才替换到 file_path; 传输失败时删除临时文件, 原有的输出文件不受影响
+    '''
+
+    def __init__(self, file_path, total_len):
+        self.file_path = file_path
+        self.temp_path = f"{file_path}.{os.getpid()}.tmp"  # 同一目录下 os.replace 是原子的
+        self.file = open(self.temp_path, 'wb+')
+        self.file.truncate(total_len)
+        self.fd = self.file.fileno()
+        self.lock = threading.Lock()  # 没有pwrite的平台(Windows)用seek+write, 需要加锁
+
+    def write_at(self, offset, data):
+        if hasattr(os, 'pwrite'):
+            view = memoryview(data)
+            while len(view):
+                written = os.pwrite(self.fd, view, offset)
+                view = view[written:]
+                offset += written
+        else:
+            with self.lock:
+                self.file.seek(offset)
+                self.file.write(data)
+
+    def close(self, ok=False):
+        self.file.close()
+        if ok:
+            os.replace(self.temp_path, self.file_path)
+        else:
+            with contextlib.suppress(OSError):
+                os.remove(self.temp_path)
+
+
+def split_ranges(chunk_sizes, n_chunks, connections):
+    '''把n_chunks个块按顺序均分给connections条连接, 返回[(首块序号, 块数, 首块在文件中的偏移)]'''
+    base, extra = divmod(n_chunks, connections)
+    ranges = []
+    first = 0
+    offset = 0
+    sizes = iter(chunk_sizes)
+    for k in range(connections):
+        count = base + (1 if k < extra else 0)
+        ranges.append((first, count, offset))
+        for _ in range(count):
+            offset += next(sizes)
+        first += count
+    return ranges
+
+
+def recv_answer(reader, codec):
+    '''读取一个完整的reverseAnswer报文并按codec还原, 未压缩时返回指向接收缓冲区的memoryview, 断开或类型错误时返回None'''
+    answer_header = reader.read_header()
+    if answer_header is None:
+        print("错误：在接收answer报文时与服务器断开连接!")
+        return None
+
+    answer_type, answer_length = answer_header
+    answer_type, flags = split_type(answer_type)
+    if answer_type != 4:
+        print(f"无效的报文类型!")
+        print(f"期望收到报文类型4.")
+        print(f"接收到报文类型{answer_type}.")  # 修正：使用answer_type变量
+        return None
+
+    reversed_data = reader.read_payload(answer_length)
+    if reversed_data is None:
+        print("错误：与服务器在接收反转数据时断开连接!")
+        return None
     try:
-        server_host, server_port, data_file_path, Lmin, Lmax = input_check()  # 读入cmd数据
+        return codec.decode(flags, reversed_data)
+    except ValueError as e:
+        print(f"错误：反转数据无法解码: {e}")
+        return None
 
-        # 建立连接
-        socket_client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        socket_client.connect((server_host, server_port))
 
-        data = get_data_from_file(data_file_path)  # 获取数据
-        chunks = spilt_chunks(data, Lmin, Lmax)  # 分割数据
-        if len(chunks) <= 0:
-            print("数据包分割出错!请输入正确的Lmin,Lmax!")
-            return
-        n_reverse_chunks = len(chunks)
+def send_request(socket_client, chunk, codec):
+    '''发送一个reverseRequest报文, 协商了压缩时超过阈值的块压缩后发送'''
+    flags, payload = codec.encode(chunk)
+    send_frame(socket_client, make_type(3, flags), payload)  # 报文头和数据不拼接
 
-        # 发送初始化报文1
-        initialization_packet = struct.pack('>HI', 1, n_reverse_chunks)
-        socket_client.sendall(initialization_packet)
 
-        agree_packet = b""
-        while len(agree_packet) < 2:  # 确保读入两个字节
-            agree_chunk = socket_client.recv(2 - len(agree_packet))
-            if not agree_chunk:
-                print("错误：在接收agree报文时与服务器断开连接!")
+def send_requests(socket_client, chunks, codec, window, stop, errors):
+    '''发送线程: 连续发送reverseRequest, 在途请求数由window信号量限制'''
+    try:
+        for chunk in chunks:
+            window.acquire()
+            if stop.is_set():
                 return
-            agree_packet += agree_chunk
+            send_request(socket_client, chunk, codec)
+    except OSError as e:
+        errors.append(e)
 
-        packet_type, = struct.unpack('>H', agree_packet)
-        if packet_type != 2:
-            print(f"无效的报文类型!")
-            print(f"期望收到报文类型2.")
-            print(f"接收到报文类型{packet_type}.")
-            return
 
-        reversed_chunks = []
+def exchange_chunks(socket_client, chunks, on_answer, pipeline=1, n_chunks=None, codec=None):
+    '''按顺序发送所有块并按顺序收取反转结果, 每收到一块调用on_answer(i, reversed_data); 全部成功返回True
+
+    reversed_data 指向复用的接收缓冲区, on_answer 需要保留时自行拷贝
+
+    pipeline为1时发一个等一个; 大于1时由发送线程连续发送, 当前线程按序读取应答,
+    最多pipeline个请求在途, 总耗时从 N×RTT 降为约 1个RTT加传输时间
+    '''
+    if n_chunks is None:
+        n_chunks = len(chunks)
+    if codec is None:
+        codec = PayloadCodec()
+    reader = FramedReader(socket_client)
+    if pipeline <= 1:
         for i, chunk in enumerate(chunks):
-            request_header = struct.pack('>HI', 3, len(chunk))
-            socket_client.sendall(request_header + chunk)  # 发送数据包
-
-            answer_header = b''
-            while len(answer_header) < 6:
-                answer_chunk = socket_client.recv(6 - len(answer_header))
-                if not answer_chunk:
-                    print("错误：在接收answer报文时与服务器断开连接!")
-                    return
-                answer_header += answer_chunk
-
-            answer_type, answer_length = struct.unpack('>HI', answer_header)
-            if answer_type != 4:
-                print(f"无效的报文类型!")
-                print(f"期望收到报文类型4.")
-                print(f"接收到报文类型{answer_type}.")  # 修正：使用answer_type变量
-                return
+            send_request(socket_client, chunk, codec)  # 发送数据包
+            reversed_data = recv_answer(reader, codec)
+            if reversed_data is None:
+                return False
+            on_answer(i, reversed_data)
+        return True
+
+    window = threading.Semaphore(pipeline)
+    stop = threading.Event()
+    errors = []
+    sender = threading.Thread(target=send_requests, args=(socket_client, chunks, codec, window, stop, errors), daemon=True)
+    sender.start()
+    completed = False
+    try:
+        for i in range(n_chunks):
+            reversed_data = recv_answer(reader, codec)
+            if reversed_data is None:
+                return False
+            on_answer(i, reversed_data)
+            window.release()  # 收到一个应答, 允许再发一个请求
+        completed = True
+    finally:
+        stop.set()
+        window.release()  # 唤醒可能阻塞在acquire上的发送线程
+        if not completed:
+            # 发送线程可能阻塞在sendall上, 关闭连接让它出错返回; 等它退出后调用方才能安全地关闭块来源(mmap)
+            with contextlib.suppress(OSError):
+                socket_client.shutdown(socket.SHUT_RDWR)
+        sender.join()
+    if errors:
+        print(f"发送reverseRequest时出错: {errors[0]}")
+        return False
+    return True
 
-            reversed_data = b''
-            while len(reversed_data) < answer_length:
-                reversed_chunk = socket_client.recv(answer_length - len(reversed_data))
-                if not reversed_chunk:
-                    print("错误：与服务器在接收反转数据时断开连接!")
-                    return
-                reversed_data += reversed_chunk
 
+def handshake(socket_client, n_reverse_chunks, caps=0):
+    '''发送初始化报文并等待agree报文, 成功返回服务端同意的能力, 失败返回None'''
+    # 发送初始化报文1, 高8位带上想要使用的能力
+    initialization_packet = HEADER.pack(make_type(1, caps), n_reverse_chunks)
+    socket_client.sendall(initialization_packet)
+
+    # agree报文只有2字节, 直接读进小缓冲区, 不为它分配 FramedReader 的大缓冲区
+    agree = bytearray(AGREE.size)
+    if not recv_exact_into(socket_client, memoryview(agree)):
+        print("错误：在接收agree报文时与服务器断开连接!")
+        return None
+
+    packet_type, accepted_caps = split_type(AGREE.unpack(agree)[0])
+    if packet_type != 2:
+        print(f"无效的报文类型!")
+        print(f"期望收到报文类型2.")
+        print(f"接收到报文类型{packet_type}.")
+        return None
+    return accepted_caps & caps
+
+
+def open_connection(server, timeout=None):
+    sock = socket.create_connection(server, timeout=timeout)
+    # 每个报文都是一次完整发出的, 关闭 Nagle 算法, 否则流水线模式下小报文会被对方的延迟确认卡住
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+def connect_and_handshake(server, n_chunks, caps=0, timeout=None):
+    '''建立连接并握手, 返回 (socket, 服务端同意的能力, 实际请求的能力), 握手失败时同意的能力为None
+
+    旧服务端不认识带能力的报文类型, 会直接断开连接; 此时重新连接, 不带能力再握手一次
+    '''
+    sock = open_connection(server, timeout)
+    try:
+        accepted_caps = handshake(sock, n_chunks, caps)
+        if accepted_caps is None and caps:
+            sock.close()
+            print("服务器不支持带能力的握手, 重新连接并使用基本协议")
+            caps = 0
+            sock = open_connection(server, timeout)
+            accepted_caps = handshake(sock, n_chunks, caps)
+    except BaseException:
+        sock.close()
+        raise
+    return sock, accepted_caps, caps
+
+
+def transfer_range(server, chunks, n_chunks, first_index, start_offset, total_len, writer, options):
+    '''用一条独立的连接完成一段连续块的握手和反转, 结果按全局偏移写入writer, 成功返回True'''
+    socket_client = None
+    try:
+        caps = CAP_ZLIB if options['compress'] else 0
+        socket_client, accepted_caps, _ = connect_and_handshake(server, n_chunks, caps)
+        if accepted_caps is None:
+            return False
+        if caps and not accepted_caps & CAP_ZLIB:
+            print("服务器不支持压缩, 使用原始数据传输")
+        codec = PayloadCodec(enabled=bool(accepted_caps & CAP_ZLIB), threshold=options['compress-threshold'])
+
+        # 文件中偏移为off、长度为l的块, 反转后位于整个反转文件的 total_len - off - l 处, 直接写到最终位置
+        received = 0
+
+        def on_answer(i, reversed_data):
+            nonlocal received
+            received += len(reversed_data)
+            writer.write_at(total_len - start_offset - received, reversed_data)
+            if options['stream']:
+                return
             # 输出反转结果
             try:
-                text = reversed_data.decode('ascii')
+                text = bytes(reversed_data).decode('ascii')
             except UnicodeDecodeError:
-                text = str(reversed_data)
-            print(f"{i + 1}: {text}")
-            reversed_chunks.insert(0, reversed_data)  # 将反转块插入列表开头
+                text = str(bytes(reversed_data))
+            print(f"{first_index + i + 1}: {text}")
+
+        return exchange_chunks(socket_client, chunks, on_answer, options['pipeline'], n_chunks, codec)
+    except OSError as e:
+        print(f"第{first_index + 1}块起的连接发生错误: {e}")
+        return False
+    finally:
+        if socket_client is not None:
+            socket_client.close()  # 确保关闭socket连接
+
+
+class ReverseClient:
+    '''可复用的reverse客户端库: 在一条连接上依次完成多个反转任务, 省去每个文件的建连和拆连
+
+    握手时请求会话能力, 服务端不支持时退回每个任务一条连接; 旧服务端不认识带能力的握手时, 之后的任务都不再请求能力
+    '''
+
+    def __init__(self, host, port, pipeline=1, compress=False, compress_threshold=DEFAULT_COMPRESS_THRESHOLD,
+                 timeout=None):
+        self.server = (host, port)
+        self.pipeline = pipeline
+        self.compress = compress
+        self.compress_threshold = compress_threshold
+        self.timeout = timeout
+        self.use_caps = True
+        self.sock = None
+
+    def reverse_chunks(self, chunks):
+        '''完成一个任务: 把chunks依次反转, 返回整个数据反转后的结果(即各块反转后逆序拼接)'''
+        n_chunks = len(chunks)
+        if n_chunks <= 0:
+            raise ValueError("要做reverse的块数必须是正整数!")
+        caps = (CAP_SESSION | (CAP_ZLIB if self.compress else 0)) if self.use_caps else 0
+        try:
+            if self.sock is None:
+                self.sock, accepted_caps, sent_caps = connect_and_handshake(self.server, n_chunks, caps, self.timeout)
+                if caps and not sent_caps:
+                    self.use_caps = False
+            else:
+                accepted_caps = handshake(self.sock, n_chunks, caps)  # 会话中的下一个任务
+            sock = self.sock
+            if accepted_caps is None:
+                raise ConnectionError("握手失败")
+            codec = PayloadCodec(enabled=bool(accepted_caps & CAP_ZLIB), threshold=self.compress_threshold)
+
+            total_len = sum(len(chunk) for chunk in chunks)
+            result = bytearray(total_len)
+            received = 0
+
+            def on_answer(i, reversed_data):
+                nonlocal received
+                received += len(reversed_data)
+                result[total_len - received: total_len - received + len(reversed_data)] = reversed_data
+
+            if not exchange_chunks(sock, chunks, on_answer, self.pipeline, n_chunks, codec):
+                raise ConnectionError("反转任务未完成")
+        except BaseException:
+            self.close()  # 连接状态已不可知, 不能再复用
+            raise
+        if not accepted_caps & CAP_SESSION:
+            self.close()  # 服务端处理完一个任务就会关闭连接
+        return bytes(result)
+
+    def reverse(self, data, Lmin, Lmax):
+        '''随机分块后反转整个数据'''
+        return self.reverse_chunks(spilt_chunks(data, Lmin, Lmax))
 
-        # 保存完整反转文件 (移到循环外部)
-        output_file = 'output.txt'
-        with open(output_file, 'wb') as f:
-            for chunk in reversed_chunks:
-                f.write(chunk)
-        print(f"文件已成功保存在:{output_file}")
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ReverseClientPool:
+    '''ReverseClient 小型连接池: 最多同时占用max_size条连接, 用完的连接放回池中给后续任务复用'''
+
+    def __init__(self, host, port, max_size=4, **client_options):
+        self.host = host
+        self.port = port
+        self.client_options = client_options
+        self.slots = threading.BoundedSemaphore(max_size)
+        self.idle = []
+        self.lock = threading.Lock()
+        self.closed = False
+
+    @contextlib.contextmanager
+    def client(self):
+        '''借出一个客户端, 出错的连接直接丢弃, 正常的放回池中'''
+        self.slots.acquire()
+        try:
+            with self.lock:
+                client = self.idle.pop() if self.idle else None
+            if client is None:
+                client = ReverseClient(self.host, self.port, **self.client_options)
+            try:
+                yield client
+            except BaseException:
+                client.close()
+                raise
+            with self.lock:
+                if self.closed:
+                    client.close()
+                else:
+                    self.idle.append(client)
+        finally:
+            self.slots.release()
+
+    def reverse(self, data, Lmin, Lmax):
+        with self.client() as client:
+            return client.reverse(data, Lmin, Lmax)
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            idle, self.idle = self.idle, []
+        for client in idle:
+            client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def create_client():
+    chunks = None
+    try:
+        server_host, server_port, data_file_path, Lmin, Lmax, options = input_check()  # 读入cmd数据
+        server = (server_host, server_port)
+
+        if options['stream']:
+            chunks = MmapChunkSource(data_file_path, Lmin, Lmax)  # 流式分块, 不读入整个文件
+            total_len = chunks.total_len
+        else:
+            data = get_data_from_file(data_file_path)  # 获取数据
+            chunks = spilt_chunks(data, Lmin, Lmax)  # 分割数据
+            total_len = len(data)
+        if len(chunks) <= 0:
+            print("数据包分割出错!请输入正确的Lmin,Lmax!")
+            return
+        n_reverse_chunks = len(chunks)
+        connections = min(options['connections'], n_reverse_chunks)
+
+        writer = OffsetWriter(OUTPUT_FILE, total_len)
+        ok = False
+        try:
+            if connections == 1:
+                ok = transfer_range(server, chunks, n_reverse_chunks, 0, 0, total_len, writer, options)
+            else:
+                # 多条连接并行, 每条连接各自握手并负责一段连续的块
+                if isinstance(chunks, MmapChunkSource):
+                    ranges = split_ranges(chunks.chunk_sizes(), n_reverse_chunks, connections)
+                else:
+                    ranges = split_ranges((len(c) for c in chunks), n_reverse_chunks, connections)
+                results = [False] * len(ranges)
+
+                def worker(k, first, count, offset):
+                    if isinstance(chunks, MmapChunkSource):
+                        part = chunks.chunk_range(first, count)
+                    else:
+                        part = chunks[first: first + count]
+                    results[k] = transfer_range(server, part, count, first, offset, total_len, writer, options)
+
+                threads = [threading.Thread(target=worker, args=(k,) + r) for k, r in enumerate(ranges)]
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+                ok = all(results)
+        finally:
+            writer.close(ok)
+        if not ok:
+            return
+        print(f"共{n_reverse_chunks}块, {total_len}字节, 使用{connections}条连接")
+        print(f"文件已成功保存在:{OUTPUT_FILE}")
 
     except Exception as e:
         print(f"客户端发生错误: {e}")
     finally:
-        socket_client.close()  # 确保关闭socket连接
+        if isinstance(chunks, MmapChunkSource):
+            chunks.close()
 
 
 def main():
@@ -143,4 +593,4 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -1,97 +1,215 @@
+import argparse
 import socket
-import struct
 import threading
+import time
 
+from reverseprotocol import (AGREE, CAP_SESSION, CAP_ZLIB, DEFAULT_SPILL_THRESHOLD, FLAG_COMPRESSED, HEADER,
+                             SUPPORTED_CAPS, FramedReader, PayloadCodec, Reverser, SpillFile, make_type, send_frame,
+                             split_type)
+from reversemetrics import METRICS, start_metrics_server, start_stats_dump
 
-def create_server_socket(host, port):
+
+def bind_server_socket(host, port, backlog=5, reuse_port=False):
+    '''创建监听socket; reuse_port为True时多个进程可以绑定同一端口, 由内核分配连接'''
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
     server_socket.bind((host, port))
-    server_socket.listen(5)
-    print(f"服务端已启动! ip地址: {host} 端口号:{port}")
-    print(f"正在等待客户端连接......")
+    server_socket.listen(backlog)
+    return server_socket
 
+
+def serve_forever(server_socket, spill_threshold=DEFAULT_SPILL_THRESHOLD):
+    '''接受连接, 每个连接一个线程'''
     client_count = 0
     while True:
         client_count += 1
         conn, address = server_socket.accept()
+        METRICS.connections.inc()
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # 应答都是整块发出的, 不需要 Nagle 合并
         print(f"服务器已接受到客户端{client_count}号的连接请求,客户端信息{address}")
-        thread = threading.Thread(target=client_handler, args=(conn, address, client_count))
+        thread = threading.Thread(target=client_handler, args=(conn, address, client_count, spill_threshold))
         thread.start()
 
 
-def client_handler(conn, address, num):
+def create_server_socket(host, port, spill_threshold=DEFAULT_SPILL_THRESHOLD):
+    server_socket = bind_server_socket(host, port)
+    print(f"服务端已启动! ip地址: {host} 端口号:{port}")
+    print(f"正在等待客户端连接......")
+    serve_forever(server_socket, spill_threshold)
+
+
+def client_handler(conn, address, num, spill_threshold=DEFAULT_SPILL_THRESHOLD):
+    METRICS.active_connections.inc()
     try:
-        # 接收初始化报文
-        initialization_data = b''
-        while len(initialization_data) < 6:
-            chunk = conn.recv(6 - len(initialization_data))
-            if not chunk:
-                print(f"客户端{num}连接断开!")
+        reader = FramedReader(conn)  # 同一连接内复用接收缓冲区
+        reverser = Reverser()  # 同一连接内复用反转输出缓冲区
+        jobs = 0
+
+        while True:
+            # 接收初始化报文
+            initialization_header = reader.read_header()
+            if initialization_header is None:
+                if jobs == 0:
+                    METRICS.handshake_failures.inc(1, 'disconnected')
+                    print(f"客户端{num}连接断开!")
                 return
-            initialization_data += chunk
-
-        # 解析初始化报文
-        try:
-            packet_type, n_reverse_chunks = struct.unpack('>HI', initialization_data)
-        except struct.error:
-            print(f"客户端{num}发送的初始化报文格式错误")
-            return
-
-        if packet_type != 1:
-            print(f"无效的报文类型! 期望1, 实际收到{packet_type}")
-            return
-
-        if n_reverse_chunks <= 0:
-            print("要做reverse的块数必须是正整数!")
-            return
-
-        # 发送同意报文
-        conn.sendall(struct.pack('>H', 2))
-
-        for i in range(n_reverse_chunks):
-            # 读取请求头
-            request_header = b""
-            while len(request_header) < 6:
-                req_header_chunk = conn.recv(6 - len(request_header))
-                if not req_header_chunk:
-                    print(f"客户端{num}在发送reverseRequest报文时断开连接!")
-                    return
-                request_header += req_header_chunk
-
-            # 解析请求头
-            try:
-                packet_type, len_data = struct.unpack('>HI', request_header)
-            except struct.error:
-                print(f"客户端{num}发送的请求头格式错误")
+
+            # 解析初始化报文, 高8位是客户端请求的能力
+            packet_type, n_reverse_chunks = initialization_header
+            packet_type, caps = split_type(packet_type)
+
+            if packet_type != 1:
+                METRICS.handshake_failures.inc(1, 'bad_type')
+                print(f"无效的报文类型! 期望1, 实际收到{packet_type}")
                 return
 
-            if packet_type != 3:
-                print(f"无效的报文类型! 期望3, 实际收到{packet_type}")
+            if n_reverse_chunks <= 0:
+                METRICS.handshake_failures.inc(1, 'bad_chunk_count')
+                print("要做reverse的块数必须是正整数!")
                 return
 
-            # 接收数据
-            data = b""
-            while len(data) < len_data:
-                data_chunk = conn.recv(min(4096, len_data - len(data)))  # 添加缓冲区大小限制
-                if not data_chunk:  # 关键修复：使用正确的变量名 data_chunk
-                    print(f"客户端{num}在发送reverse数据时断开连接!")
-                    return
-                data += data_chunk
+            # 发送同意报文, 带上双方都支持的能力
+            accepted_caps = caps & SUPPORTED_CAPS
+            codec = PayloadCodec(enabled=bool(accepted_caps & CAP_ZLIB))
+            conn.sendall(AGREE.pack(make_type(2, accepted_caps)))
+            METRICS.bytes_received.inc(HEADER.size)
+            METRICS.bytes_sent.inc(AGREE.size)
 
-            # 反转数据并发送响应
-            reversed_data = data[::-1]
-            answer_header = struct.pack('>HI', 4, len(reversed_data))
-            conn.sendall(answer_header + reversed_data)
+            if not reverse_chunks(conn, reader, reverser, codec, n_reverse_chunks, num, spill_threshold):
+                return
+            jobs += 1
+            METRICS.jobs.inc()
+
+            # 会话模式下继续等待同一连接上的下一个任务, 否则和原来一样处理完就关闭
+            if not accepted_caps & CAP_SESSION:
+                return
 
     except Exception as e:
         print(f"处理客户端{num}时发生错误: {e}")
     finally:
+        METRICS.active_connections.dec()
         conn.close()
         print(f"客户端{num}断开连接!")
 
 
+def reverse_chunks(conn, reader, reverser, codec, n_reverse_chunks, num, spill_threshold=DEFAULT_SPILL_THRESHOLD):
+    '''处理一个任务的n_reverse_chunks个reverseRequest, 全部完成返回True
+
+    超过spill_threshold的块落盘反转, 每个连接占用的内存不随块的大小增长;
+    每块分别统计接收、反转、发送三段耗时, 落盘的块反转和发送交织进行, 合计在发送耗时里
+    '''
+    for i in range(n_reverse_chunks):
+        # 读取并解析请求头
+        request_header = reader.read_header()
+        if request_header is None:
+            print(f"客户端{num}在发送reverseRequest报文时断开连接!")
+            return False
+        start = time.perf_counter()  # 收到请求头才开始计时, 会话中等待下一个请求的空闲时间不计入接收耗时
+        packet_type, len_data = request_header
+        packet_type, flags = split_type(packet_type)
+
+        if packet_type != 3:
+            print(f"无效的报文类型! 期望3, 实际收到{packet_type}")
+            return False
+
+        if len_data > spill_threshold:
+            # 超大块: 边收边写入临时文件(压缩的边收边解压), 不在内存中保存整块
+            spill = SpillFile()
+            try:
+                if not receive_spilled(reader, len_data, flags, codec, spill):
+                    print(f"客户端{num}在发送reverse数据时断开连接!")
+                    return False
+                received = time.perf_counter()
+                send_spilled(conn, spill)
+            finally:
+                spill.close()
+            METRICS.record_chunk(HEADER.size + len_data, HEADER.size + spill.length,
+                                 start, received, received, time.perf_counter(), True)
+            continue
+
+        # 接收数据, 直接读入复用的缓冲区
+        data = reader.read_payload(len_data)
+        if data is None:
+            print(f"客户端{num}在发送reverse数据时断开连接!")
+            return False
+
+        received = time.perf_counter()
+
+        if codec.raw_length(flags, data) > spill_threshold:
+            # 压缩后不大但解压后超过阈值, 同样解压到临时文件
+            spill = SpillFile()
+            try:
+                decoder = codec.stream_decoder(spill.write, spill.block_size)
+                decoder.feed(data)
+                decoder.finish()
+                reversed_at = time.perf_counter()
+                send_spilled(conn, spill)
+            finally:
+                spill.close()
+            METRICS.record_chunk(HEADER.size + len_data, HEADER.size + spill.length,
+                                 start, received, reversed_at, time.perf_counter(), True)
+            continue
+        data = codec.decode(flags, data)
+
+        # 反转到复用的输出缓冲区, 报文头和数据用向量I/O一起发送
+        flags, answer = codec.encode(reverser.reverse(data))
+        reversed_at = time.perf_counter()
+        send_frame(conn, make_type(4, flags), answer)
+        METRICS.record_chunk(HEADER.size + len_data, HEADER.size + len(answer),
+                             start, received, reversed_at, time.perf_counter())
+    return True
+
+
+def receive_spilled(reader, len_data, flags, codec, spill):
+    '''把超大块按spill.block_size分段收下并写入spill, 压缩数据边收边解压, 连接断开返回False'''
+    decoder = codec.stream_decoder(spill.write, spill.block_size) if flags & FLAG_COMPRESSED else None
+    remaining = len_data
+    while remaining > 0:
+        part = reader.read_payload(min(spill.block_size, remaining))
+        if part is None:
+            return False
+        remaining -= len(part)
+        if decoder is not None:
+            decoder.feed(part)
+        else:
+            spill.write(part)
+    if decoder is not None:
+        decoder.finish()
+    return True
+
+
+def send_spilled(conn, spill):
+    '''先发送reverseAnswer报文头, 再从文件末尾往前逐块发送反转后的数据(不压缩)'''
+    conn.sendall(HEADER.pack(4, spill.length))
+    for block in spill.reversed_blocks():
+        conn.sendall(block)
+
+
+def start_monitoring(metrics_port=None, stats_interval=None, metrics_host='127.0.0.1'):
+    '''按需启动指标接口和周期性统计输出, 两者都在后台线程中运行'''
+    if metrics_port:
+        start_metrics_server(metrics_port, metrics_host)
+    if stats_interval:
+        start_stats_dump(stats_interval)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="reverse 服务端, 每个连接一个线程")
+    parser.add_argument('host', nargs='?', default="127.0.0.1")
+    parser.add_argument('port', nargs='?', type=int, default=6666)
+    parser.add_argument('--spill-threshold', type=int, default=DEFAULT_SPILL_THRESHOLD,
+                        help="超过该字节数的块落盘反转")
+    parser.add_argument('--metrics-port', type=int, help="在该端口提供 Prometheus 文本格式的 /metrics 接口")
+    parser.add_argument('--stats-interval', type=float, help="每隔多少秒打印一行统计摘要")
+    args = parser.parse_args()
+    if args.spill_threshold <= 0:
+        parser.error("spill-threshold 必须是正整数!")
+    return args
+
+
 if __name__ == '__main__':
-    server_host = "127.0.0.1"
-    server_port = 6666
-    create_server_socket(server_host, server_port)
\ No newline at end of file
+    args = parse_args()
+    start_monitoring(args.metrics_port, args.stats_interval)
+    create_server_socket(args.host, args.port, args.spill_threshold)
\ No newline at end of file
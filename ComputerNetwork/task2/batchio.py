@@ -0,0 +1,291 @@
+import ctypes
+import errno
+import os
+import select
+import socket
+import struct
+import sys
+
+from packet import MAX_PACKET_SIZE
+
+# 批量收发: Linux 上用 recvmmsg/sendmmsg 一次系统调用收发多个数据报, 其他平台退回 recvfrom_into/sendto
+# 只支持 IPv4 (本项目的客户端和服务器都是 AF_INET)
+
+SOCKADDR_IN_SIZE = 16
+DEFAULT_BATCH = 64  # 一次最多收发的数据报个数
+MAX_CACHED_ADDRESSES = 65536
+
+
+class iovec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+
+class msghdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p), ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(iovec)), ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p), ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', msghdr), ('msg_len', ctypes.c_uint)]
+
+
+# 每个包都要读写的几个字段直接按偏移在原始内存上 pack_into/unpack_from, 比通过 ctypes 结构体属性访问快得多
+MSG_STRIDE = ctypes.sizeof(mmsghdr)
+MSG_LEN_OFFSET = mmsghdr.msg_len.offset
+MSG_NAMELEN_OFFSET = mmsghdr.msg_hdr.offset + msghdr.msg_namelen.offset
+IOV_STRIDE = ctypes.sizeof(iovec)
+IOV_LEN_OFFSET = iovec.iov_len.offset
+_UINT = struct.Struct('I')
+_SIZE_T = struct.Struct('N')
+
+
+def load_mmsg():
+    '''从 libc 中取出 recvmmsg/sendmmsg, 不是 Linux 或 libc 太旧时返回 (None, None)'''
+    if not sys.platform.startswith('linux'):
+        return None, None
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        recvmmsg, sendmmsg = libc.recvmmsg, libc.sendmmsg
+    except (OSError, AttributeError):
+        return None, None
+    recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    recvmmsg.restype = ctypes.c_int
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int]
+    sendmmsg.restype = ctypes.c_int
+    return recvmmsg, sendmmsg
+
+
+_recvmmsg, _sendmmsg = load_mmsg()
+HAVE_MMSG = _recvmmsg is not None
+
+
+def batch_supported(sock):
+    return HAVE_MMSG and sock.family == socket.AF_INET and sock.type == socket.SOCK_DGRAM
+
+
+class _MessageVector:
+    '''count 个定长缓冲区和对应的 mmsghdr/iovec/地址, 创建时一次性填好指针, 收发时只改长度'''
+
+    def __init__(self, count, buffer_size):
+        self.count = count
+        self.buffers = [bytearray(buffer_size) for _ in range(count)]
+        self.views = [memoryview(b) for b in self.buffers]
+        self.names = bytearray(SOCKADDR_IN_SIZE * count)
+        self.iovecs = (iovec * count)()
+        self.msgs = (mmsghdr * count)()
+        # 这些 ctypes 对象引用着缓冲区, 保证缓冲区在使用期间不会被移动
+        self._c_buffers = [(ctypes.c_char * buffer_size).from_buffer(b) for b in self.buffers]
+        self._c_names = (ctypes.c_char * len(self.names)).from_buffer(self.names)
+        names_base = ctypes.addressof(self._c_names)
+        for i in range(count):
+            self.iovecs[i].iov_base = ctypes.addressof(self._c_buffers[i])
+            self.iovecs[i].iov_len = buffer_size
+            hdr = self.msgs[i].msg_hdr
+            hdr.msg_name = names_base + i * SOCKADDR_IN_SIZE
+            hdr.msg_namelen = SOCKADDR_IN_SIZE
+            hdr.msg_iov = ctypes.pointer(self.iovecs[i])
+            hdr.msg_iovlen = 1
+        self.msg_raw = memoryview(self.msgs).cast('B')
+        self.iov_raw = memoryview(self.iovecs).cast('B')
+        self.slot_addrs = [None] * count  # 每个发送槽位当前写着的目的地址
+
+
+def _wait(sock, events, timeout):
+    '''等待 socket 可读/可写, timeout 为 None 时一直等; 超时返回 False'''
+    poller = select.poll()
+    poller.register(sock.fileno(), events)
+    return bool(poller.poll(None if timeout is None else timeout * 1000))
+
+
+def _raise_errno():
+    err = ctypes.get_errno()
+    raise OSError(err, os.strerror(err))  # OSError 会按 errno 变成 ConnectionRefusedError 等子类, 与 socket 方法一致
+
+
+class BatchReceiver:
+    '''一次系统调用收下所有已到达的数据报(最多 count 个)
+
+    recv 的等待时间与 socket 的超时设置一致: 超时抛出 socket.timeout, 超时为 0 时没有数据抛出 BlockingIOError,
+    和 recvfrom 一样; 返回 [(memoryview, 地址), ...], memoryview 只在下一次 recv 之前有效
+    '''
+
+    def __init__(self, sock, count=DEFAULT_BATCH, buffer_size=MAX_PACKET_SIZE, batched=None):
+        self.sock = sock
+        self.batched = batch_supported(sock) if batched is None else batched and batch_supported(sock)
+        self.syscalls = 0
+        self.datagrams = 0
+        self.addresses = {}  # sockaddr 字节 -> (ip, port), 同一个对端不用每次解析
+        if self.batched:
+            self.vector = _MessageVector(count, buffer_size)
+        else:
+            self.buffer = bytearray(buffer_size)
+            self.view = memoryview(self.buffer)
+
+    def recv(self):
+        if not self.batched:
+            n, addr = self.sock.recvfrom_into(self.buffer)
+            self.syscalls += 1
+            self.datagrams += 1
+            return [(self.view[:n], addr)]
+
+        vector = self.vector
+        fd = self.sock.fileno()
+        timeout = self.sock.gettimeout()
+        while True:
+            n = _recvmmsg(fd, vector.msgs, vector.count, socket.MSG_DONTWAIT, None)
+            self.syscalls += 1
+            if n >= 0:
+                break
+            err = ctypes.get_errno()
+            if err == errno.EINTR:
+                continue
+            if err not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                _raise_errno()
+            if timeout == 0:
+                raise BlockingIOError(err, os.strerror(err))
+            if not _wait(self.sock, select.POLLIN, timeout):
+                raise socket.timeout("timed out")
+
+        messages = []
+        names = vector.names
+        views = vector.views
+        msg_raw = vector.msg_raw
+        addresses = self.addresses
+        for i in range(n):
+            base = i * MSG_STRIDE
+            _UINT.pack_into(msg_raw, base + MSG_NAMELEN_OFFSET, SOCKADDR_IN_SIZE)  # 内核会改写它, 下次收之前恢复
+            offset = i * SOCKADDR_IN_SIZE
+            raw = bytes(names[offset + 2:offset + 8])  # 端口(2B) + IPv4地址(4B), 都是网络字节序
+            addr = addresses.get(raw)
+            if addr is None:
+                if len(addresses) >= MAX_CACHED_ADDRESSES:  # 长时间运行的服务器会见到大量不同的客户端地址
+                    addresses.clear()
+                addr = addresses[raw] = (socket.inet_ntoa(raw[2:]), int.from_bytes(raw[:2], 'big'))
+            messages.append((views[i][:_UINT.unpack_from(msg_raw, base + MSG_LEN_OFFSET)[0]], addr))
+        self.datagrams += n
+        return messages
+
+
+class BatchSender:
+    '''send 只是把数据报拷贝进待发送队列, flush 用一次 sendmmsg 发出; 队列满时自动 flush
+
+    不支持批量发送时 send 直接调用 sendto, flush 什么也不做, 调用方不用区分;
+    packet 也可以是几段缓冲区组成的元组(如 header 和数据), 逐包发送时用 sendmsg 直接发出, 批量发送时依次拷进队列
+    '''
+
+    def __init__(self, sock, count=DEFAULT_BATCH, buffer_size=MAX_PACKET_SIZE, batched=None):
+        self.sock = sock
+        self.batched = batch_supported(sock) if batched is None else batched and batch_supported(sock)
+        self.buffer_size = buffer_size
+        self.syscalls = 0
+        self.datagrams = 0
+        self.pending = 0
+        self.sockaddrs = {}  # (ip, port) -> sockaddr_in 字节
+        if self.batched:
+            self.vector = _MessageVector(count, buffer_size)
+
+    def sockaddr(self, addr):
+        raw = self.sockaddrs.get(addr)
+        if raw is None:
+            host, port = addr
+            ip = socket.gethostbyname(host)  # 主机名只解析一次
+            raw = self.sockaddrs[addr] = (socket.AF_INET.to_bytes(2, sys.byteorder) + port.to_bytes(2, 'big') +
+                                          socket.inet_aton(ip) + bytes(8))
+        return raw
+
+    def send(self, packet, addr):
+        parts = packet if type(packet) is tuple else None
+        size = len(packet) if parts is None else sum(map(len, parts))
+        if not self.batched or size > self.buffer_size:
+            if self.batched:
+                self.flush()  # 保持发送顺序
+            if parts is None:
+                self.sock.sendto(packet, addr)
+            elif hasattr(self.sock, 'sendmsg'):
+                self.sock.sendmsg(parts, [], 0, addr)
+            else:  # Windows 没有 sendmsg
+                self.sock.sendto(b''.join(parts), addr)
+            self.syscalls += 1
+            self.datagrams += 1
+            return
+        vector = self.vector
+        i = self.pending
+        buffer = vector.buffers[i]
+        if parts is None:
+            buffer[:size] = packet  # 等长切片赋值, 原地拷贝
+        else:
+            offset = 0
+            for part in parts:
+                end = offset + len(part)
+                buffer[offset:end] = part
+                offset = end
+        _SIZE_T.pack_into(vector.iov_raw, i * IOV_STRIDE + IOV_LEN_OFFSET, size)
+        if vector.slot_addrs[i] != addr:  # 发给同一个对端时不用重写地址
+            offset = i * SOCKADDR_IN_SIZE
+            vector.names[offset:offset + SOCKADDR_IN_SIZE] = self.sockaddr(addr)
+            vector.slot_addrs[i] = addr
+        self.pending += 1
+        if self.pending == vector.count:
+            self.flush()
+
+    def flush(self):
+        if not self.batched or not self.pending:
+            return
+        vector = self.vector
+        fd = self.sock.fileno()
+        sent = 0
+        while sent < self.pending:
+            n = _sendmmsg(fd, ctypes.byref(vector.msgs[sent]), self.pending - sent, socket.MSG_DONTWAIT)
+            self.syscalls += 1
+            if n > 0:
+                sent += n
+                continue
+            err = ctypes.get_errno()
+            if err == errno.EINTR:
+                continue
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK):
+                _wait(self.sock, select.POLLOUT, None)  # 发送缓冲区满了, 等它腾出空间
+                continue
+            self.pending = 0
+            _raise_errno()
+        self.datagrams += sent
+        self.pending = 0
+
+
+def benchmark(count=20000, size=94, batch=DEFAULT_BATCH):
+    '''本机回环上对比逐包和批量收发 count 个 size 字节数据报的耗时'''
+    import time
+    payload = bytes(size)
+    for batched in (False, True):
+        rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        rx.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1024 * 1024)
+        rx.bind(('127.0.0.1', 0))
+        tx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        addr = rx.getsockname()
+        sender = BatchSender(tx, batch, size, batched)
+        receiver = BatchReceiver(rx, batch, size, batched)
+        rx.settimeout(0.5)
+        received = 0
+        start = time.perf_counter()
+        for sent in range(0, count, batch):  # 每发一批就收一批, 不让接收缓冲区溢出
+            for _ in range(min(batch, count - sent)):
+                sender.send(payload, addr)
+            sender.flush()
+            while received < min(sent + batch, count):
+                try:
+                    received += len(receiver.recv())
+                except socket.timeout:
+                    break
+        elapsed = time.perf_counter() - start
+        name = '批量(sendmmsg/recvmmsg)' if sender.batched else '逐包(sendto/recvfrom)'
+        print(f"  {name:<24} {elapsed / count * 1e6:7.2f} us/包  收到 {received}/{count}, "
+              f"系统调用 发送{sender.syscalls} 接收{receiver.syscalls}")
+        tx.close()
+        rx.close()
+
+
+if __name__ == '__main__':
+    print(f"recvmmsg/sendmmsg 可用: {HAVE_MMSG}")
+    benchmark()
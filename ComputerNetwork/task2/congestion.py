@@ -0,0 +1,146 @@
+import time
+
+# 拥塞控制: 客户端的发送窗口(字节)由这里的算法根据 ACK、重复ACK 和超时调整
+# 所有算法都实现同样的几个回调, 客户端只调用这些回调并读取 cwnd
+
+MSS = 80  # 客户端最大的数据包是80字节, 窗口按这个大小增减
+MAX_WINDOW = 64 * 1024  # 不超过服务器选择重传时的接收缓存
+INITIAL_SSTHRESH = MAX_WINDOW
+
+
+class CongestionControl:
+    '''固定窗口, 也是其他算法的基类: 记录 cwnd 随时间的变化, 供导出 CSV'''
+    name = 'fixed'
+
+    def __init__(self, window=400, mss=MSS):
+        self.mss = mss
+        self.cwnd = window
+        self.ssthresh = INITIAL_SSTHRESH
+        self.start_time = time.time()
+        self.history = []
+        self.record('init')
+
+    @property
+    def window(self):
+        '''发送窗口(整数字节), 至少能发出一个最大的包'''
+        return max(self.mss, min(MAX_WINDOW, int(self.cwnd)))
+
+    def record(self, event):
+        self.history.append((round(time.time() - self.start_time, 6), int(self.cwnd), int(self.ssthresh), event))
+
+    def on_ack(self, acked_bytes, srtt):
+        '''确认了 acked_bytes 字节新数据(快速恢复期间不调用), srtt 为平滑RTT(秒)'''
+
+    def on_fast_retransmit(self, flight):
+        '''3个重复ACK触发快速重传, flight 为在途字节数'''
+
+    def on_recovery_exit(self):
+        '''快速恢复结束'''
+
+    def on_timeout(self, flight):
+        '''超时重传'''
+
+
+class Reno(CongestionControl):
+    '''慢启动 + 拥塞避免(AIMD): 丢包时窗口减半, 超时时回到一个MSS重新慢启动'''
+    name = 'reno'
+
+    def __init__(self, window=None, mss=MSS):
+        super().__init__(window or 4 * mss, mss)
+
+    def on_ack(self, acked_bytes, srtt):
+        if self.cwnd < self.ssthresh:
+            self.cwnd += min(acked_bytes, self.mss)  # 慢启动: 每个ACK最多加一个MSS, 每个RTT翻倍
+            self.record('slow_start')
+        else:
+            self.cwnd += self.mss * acked_bytes / self.cwnd  # 拥塞避免: 每个RTT加一个MSS
+            self.record('avoidance')
+        self.cwnd = min(self.cwnd, MAX_WINDOW)
+
+    def on_fast_retransmit(self, flight):
+        # 按 cwnd 而不是在途字节数减半: 发送方受数据量限制时在途字节可能远小于窗口, 按它减半会把窗口压得过小
+        self.ssthresh = max(self.cwnd / 2, 2 * self.mss)
+        self.cwnd = self.ssthresh
+        self.record('fast_retransmit')
+
+    def on_recovery_exit(self):
+        self.cwnd = self.ssthresh
+        self.record('recovery_exit')
+
+    def on_timeout(self, flight):
+        self.ssthresh = max(self.cwnd / 2, 2 * self.mss)
+        self.cwnd = self.mss
+        self.record('timeout')
+
+
+class Cubic(Reno):
+    '''CUBIC(RFC 8312): 拥塞避免阶段窗口按距上次丢包的时间的三次函数增长, 与RTT无关; 慢启动和超时与 Reno 相同'''
+    name = 'cubic'
+    C = 0.4
+    BETA = 0.7
+
+    def __init__(self, window=None, mss=MSS):
+        super().__init__(window, mss)
+        self.w_max = 0.0  # 上次丢包时的窗口(以MSS计)
+        self.k = 0.0
+        self.epoch_start = None  # 本轮拥塞避免开始的时间
+        self.origin_point = 0.0
+        self.w_est = 0.0  # 按 Reno 方式估算的窗口, 保证不比 Reno 慢
+
+    def on_ack(self, acked_bytes, srtt):
+        if self.cwnd < self.ssthresh:
+            super().on_ack(acked_bytes, srtt)
+            return
+        now = time.time()
+        cwnd = self.cwnd / self.mss
+        if self.epoch_start is None:
+            self.epoch_start = now
+            if cwnd < self.w_max:
+                self.k = ((self.w_max - cwnd) / self.C) ** (1 / 3)
+                self.origin_point = self.w_max
+            else:
+                self.k = 0.0
+                self.origin_point = cwnd
+            self.w_est = cwnd
+        t = now - self.epoch_start + (srtt or 0)
+        target = self.origin_point + self.C * (t - self.k) ** 3
+        acked = acked_bytes / self.mss
+        self.w_est += 3 * (1 - self.BETA) / (1 + self.BETA) * acked / cwnd
+        if target > cwnd:
+            cwnd += (target - cwnd) / cwnd * acked
+        else:
+            cwnd += 0.01 * acked / cwnd  # 在 w_max 附近几乎不增长
+        cwnd = max(cwnd, self.w_est)
+        self.cwnd = min(cwnd * self.mss, MAX_WINDOW)
+        self.record('cubic')
+
+    def reduce(self):
+        cwnd = self.cwnd / self.mss
+        # 快速收敛: 窗口比上次丢包时还小, 说明有新的流加入, 主动让出更多带宽
+        if cwnd < self.w_max:
+            self.w_max = cwnd * (1 + self.BETA) / 2
+        else:
+            self.w_max = cwnd
+        self.epoch_start = None
+        self.ssthresh = max(self.cwnd * self.BETA, 2 * self.mss)
+
+    def on_fast_retransmit(self, flight):
+        self.reduce()
+        self.cwnd = self.ssthresh
+        self.record('fast_retransmit')
+
+    def on_timeout(self, flight):
+        self.reduce()
+        self.cwnd = self.mss
+        self.record('timeout')
+
+
+ALGORITHMS = {cls.name: cls for cls in (CongestionControl, Reno, Cubic)}
+
+
+def create_congestion_control(name='fixed', window=None, mss=MSS):
+    '''按名字创建算法; fixed 的 window 是固定窗口大小, 其他算法的 window 是初始窗口'''
+    cls = ALGORITHMS[name]
+    if cls is CongestionControl:
+        return cls(window or 400, mss)
+    return cls(window, mss)
@@ -0,0 +1,142 @@
+import argparse
+import contextlib
+import itertools
+import multiprocessing
+import os
+import queue
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from congestion import ALGORITHMS
+from packet import MODE_NAMES
+from udpclient import DEFAULT_FILE_MSS, GBNClient
+
+# 参数扫描: 对 数据包总数 x 窗口大小 x 丢包率 x 损坏率 的每种组合, 启动一个服务器子进程(丢包和损坏由服务器模拟),
+# 在另一个子进程中运行 GBNClient(输出重定向到 /dev/null), 用 GBNClient.summary() 取回结果, 最后汇总成一张表
+# 每种组合用一个新端口和新服务器, 上一次运行残留的包和连接状态不会影响下一次
+# 模拟数据的包长由 seed + 第几次运行 决定, 各组合的同一次运行发送完全相同的字节数, 吞吐量和重传比例可以直接比较
+
+ENGINES = {
+    'thread': 'udpserver.py',
+    'async': 'udpasyncserver.py',
+}
+STARTUP_DELAY = 0.5  # 等待服务器绑定端口; UDP 没有连接, 无法像 TCP 那样探测端口是否就绪
+COLUMNS = ['packets', 'window', 'loss', 'corruption', 'run', 'status', 'bytes', 'elapsed_s', 'completion_s',
+           'goodput_kbps', 'sent', 'retx_ratio', 'fast_retransmits', 'timeouts', 'rtt_p50_ms', 'rtt_p90_ms',
+           'rtt_p99_ms', 'rtt_max_ms']
+
+
+def start_server(engine, port, loss_rate, corruption_rate, extra_args, stderr=subprocess.DEVNULL):
+    '''以子进程方式启动本地服务器'''
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    cmd = [sys.executable, os.path.join(script_dir, ENGINES[engine]), str(port), str(loss_rate),
+           str(corruption_rate)] + extra_args
+    return subprocess.Popen(cmd, cwd=script_dir, stdout=subprocess.DEVNULL, stderr=stderr)
+
+
+def client_main(results, port, packets, window, mode, cc, file_path, mss, linger, seed):
+    '''客户端子进程: 逐包日志写到 /dev/null, 只把汇总结果放回队列'''
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        client = GBNClient('127.0.0.1', port, packets, window, MODE_NAMES[mode], cc, file_path, mss,
+                           linger=linger, save_stats=False, seed=seed)
+        client.run()
+        results.put(client.summary())
+
+
+def run_once(args, port, packets, window, loss_rate, corruption_rate, seed):
+    '''运行一种参数组合, 服务器启动失败、超时或客户端出错时返回 status 不为 ok 的结果'''
+    errors = tempfile.TemporaryFile()  # 服务器的错误输出, 启动失败(如端口被占用)时显示最后一行
+    server = start_server(args.engine, port, loss_rate, corruption_rate, args.server_args, errors)
+    results = multiprocessing.Queue()
+    client = multiprocessing.Process(target=client_main, args=(results, port, packets, window, args.mode, args.cc,
+                                                               args.file, args.mss, args.linger, seed))
+    try:
+        time.sleep(STARTUP_DELAY)
+        if server.poll() is not None:
+            errors.seek(0)
+            lines = errors.read().decode(errors='replace').strip().splitlines()
+            print(f"端口 {port} 的服务器启动失败: {lines[-1] if lines else f'退出码 {server.returncode}'}", file=sys.stderr)
+            return {'status': f'server exit {server.returncode}'}
+        client.start()
+        deadline = time.time() + args.timeout
+        summary = None
+        while summary is None and time.time() < deadline:
+            try:
+                summary = results.get(timeout=0.2)
+            except queue.Empty:
+                if not client.is_alive():  # 客户端出错退出, 不会再有结果
+                    break
+        if summary is None:
+            summary = {'status': 'timeout' if client.is_alive() else f'exit {client.exitcode}'}
+        else:
+            summary['status'] = 'ok'
+            client.join(timeout=1)
+    finally:
+        if client.is_alive():
+            client.terminate()
+            client.join()
+        server.terminate()
+        server.wait()
+        errors.close()
+    return summary
+
+
+def sweep(args):
+    rows = []
+    configs = list(itertools.product(args.packets, args.windows, args.loss, args.corruption, range(args.repeat)))
+    for index, (packets, window, loss_rate, corruption_rate, run) in enumerate(configs):
+        port = args.port + index  # 每种组合换一个端口
+        summary = run_once(args, port, packets, window, loss_rate, corruption_rate, args.seed + run)
+        row = dict(packets=packets, window=window, loss=loss_rate, corruption=corruption_rate, run=run)
+        row.update(summary)  # 传文件时包数以客户端的实际分段数为准
+        rows.append(row)
+        goodput = row.get('goodput_kbps')
+        print(f"[{index + 1}/{len(configs)}] 包数={packets} 窗口={window} 丢包率={loss_rate} 损坏率={corruption_rate} "
+              f"第{run + 1}次: {row['status']}" + (f", {goodput:.1f} kbit/s" if goodput else ''), file=sys.stderr)
+    return pd.DataFrame(rows).reindex(columns=COLUMNS)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="GBN/SR 传输的参数扫描基准测试, 结果汇总成一张表")
+    parser.add_argument('--engine', choices=list(ENGINES), default='thread', help="启动哪种本地服务器")
+    parser.add_argument('--port', type=int, default=9000, help="第一个组合使用的端口, 之后每个组合加1")
+    parser.add_argument('--packets', type=int, nargs='+', default=[200], help="数据包总数, 可以给多个")
+    parser.add_argument('--windows', type=int, nargs='+', default=[400, 1600], help="窗口大小(字节), 可以给多个")
+    parser.add_argument('--loss', type=float, nargs='+', default=[0.0, 0.05, 0.2], help="服务器模拟的丢包率")
+    parser.add_argument('--corruption', type=float, nargs='+', default=[0.0], help="服务器模拟的数据损坏率")
+    parser.add_argument('--repeat', type=int, default=1, help="每种组合运行的次数")
+    parser.add_argument('--seed', type=int, default=1, help="模拟数据包长的随机数种子, 第i次运行使用 seed+i")
+    parser.add_argument('--mode', choices=list(MODE_NAMES), default='gbn')
+    parser.add_argument('--cc', choices=list(ALGORITHMS), default='fixed', help="不是 fixed 时忽略 --windows")
+    parser.add_argument('--file', help="传输这个文件而不是模拟数据, 此时忽略 --packets")
+    parser.add_argument('--mss', type=int, default=DEFAULT_FILE_MSS, help="传文件时的分段大小")
+    parser.add_argument('--linger', type=float, default=0, help="客户端四次挥手后的等待时间, 默认不等待")
+    parser.add_argument('--timeout', type=float, default=120, help="单次运行的最长时间(秒)")
+    parser.add_argument('--output', help="把结果表保存为 CSV 文件")
+    parser.add_argument('--server-args', nargs=argparse.REMAINDER, default=[],
+                        help="透传给服务器的参数, 如 --server-args --ack-every 2")
+    args = parser.parse_args()
+    if min(args.packets + args.windows + [args.repeat, args.mss]) <= 0 or args.timeout <= 0:
+        parser.error("包数、窗口、repeat、mss 和 timeout 必须是正数!")
+    if not all(0 <= p <= 1 for p in args.loss + args.corruption):
+        parser.error("丢包率和损坏率必须在0~1之间!")
+    if args.file is not None:
+        if not os.path.isfile(args.file):
+            parser.error(f"文件 {args.file} 不存在!")
+        args.file = os.path.abspath(args.file)
+        args.packets = [0]  # 包数由文件大小决定
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    table = sweep(args)
+    with pd.option_context('display.max_columns', None, 'display.width', 200, 'display.float_format', '{:.3f}'.format):
+        print(table.to_string(index=False))
+    if args.output:
+        table.to_csv(args.output, index=False)
+        print(f"结果已保存到 {args.output}")
@@ -0,0 +1,175 @@
+import struct
+import threading
+
+from checksum import CHECKSUM_MASK, crc16, CRC_INIT
+
+# 我的header格式
+#! 网络协议 大端
+# 序列号 I (4B)
+# 确认号 I (4B)
+# 分组号 I (4B)
+# 标志位 4bit
+# 校验和 12 bit 两者一共 2 B
+HEADER_FORMAT = '!III H'
+HEADER = struct.Struct(HEADER_FORMAT)  # 预编译, 不必每次解析格式串
+HEADER_SIZE = HEADER.size  # 14
+FLAGS_OFFSET = 12  # 标志位+校验和 在header中的偏移
+FLAGS_FIELD = struct.Struct('!H')
+
+#标志位 这里我们只用高4位 低12位用于checksum
+mySYN = 0x8000 #1000 0000 0000 0000
+myACK = 0x4000 #0100 0000 0000 0000
+myFIN = 0x2000 #0010 0000 0000 0000
+myDATA = 0x1000 #0001 0000 0000 0000
+FLAG_MASK = 0xF000
+
+MAX_PACKET_SIZE = 65535  # 接收缓冲区大小, 能放下任何一个UDP数据报
+MAX_PAYLOAD = 65507 - HEADER_SIZE  # IPv4 下一个UDP数据报最多 65507 字节数据
+
+# 传输模式, 由 SYN 的数据部分协商: 客户端在 SYN 中带上想用的模式, 服务器在 SYN-ACK 中回复同意的模式
+# 旧版本的 SYN/SYN-ACK 不带数据, 按 GBN 处理, 所以新旧两端仍然可以互通
+# 传输文件时 SYN 的模式字节之后是 UTF-8 编码的文件名, 服务器据此命名输出文件(旧服务器只读第一个字节)
+MODE_GBN = 0
+MODE_SR = 1  # 选择重传: 接收方缓存乱序的包, ACK 的数据部分带 SACK 块
+MODE_NAMES = {'gbn': MODE_GBN, 'sr': MODE_SR}
+SYN_OPTION = struct.Struct('!B')
+
+# SACK 块: [起始字节, 结束字节) 表示接收方已经收到、但还不能累计确认的一段数据
+SACK_BLOCK = struct.Struct('!II')
+MAX_SACK_BLOCKS = 4
+
+# 校验时 header 的校验和位按 0 计算; 4 个标志位只有 16 种取值, 提前打包好, 校验时不用重新打包 header
+_FLAG_BYTES = [FLAGS_FIELD.pack(i << 12) for i in range(16)]
+
+
+def create_packet(seq, ack, pkt_num, flags, payload=b''):
+    '''创建一个独立的数据包(需要保存下来重发的包用这个), 频繁发送的包用 PacketBuilder'''
+    packet = bytearray(HEADER_SIZE + len(payload))
+    HEADER.pack_into(packet, 0, seq, ack, pkt_num, flags)
+    packet[HEADER_SIZE:] = payload
+    FLAGS_FIELD.pack_into(packet, FLAGS_OFFSET, flags | crc16(packet, CRC_INIT) & CHECKSUM_MASK)  # 此时校验和位还是 0
+    return packet
+
+
+def unpack_header(data):
+    '''解析header, data 可以是整个数据包'''
+    seq, ack, pkt_num, flags_with_checksum = HEADER.unpack_from(data)
+    flags = flags_with_checksum & FLAG_MASK
+    checksum = flags_with_checksum & CHECKSUM_MASK
+    return seq, ack, pkt_num, flags, checksum
+
+
+def verify_checksum(data):
+    '''验证校验和'''
+    #对方发过来的checksum 我自己算一遍检查一下
+    if len(data) < HEADER_SIZE:
+        return False
+    # 分三段增量计算 CRC: 校验和位按 0 计算, 不重新打包 header, 也不拼接 header 和数据; data 可以是 memoryview
+    view = memoryview(data)
+    crc = crc16(view[:FLAGS_OFFSET], CRC_INIT)
+    crc = crc16(_FLAG_BYTES[data[FLAGS_OFFSET] >> 4], crc)
+    crc = crc16(view[HEADER_SIZE:], crc)
+    recv_checksum = (data[FLAGS_OFFSET] & 0x0F) << 8 | data[FLAGS_OFFSET + 1]
+    return crc & CHECKSUM_MASK == recv_checksum
+
+
+def parse_mode(payload):
+    '''从 SYN/SYN-ACK 的数据部分取出传输模式, 没有数据就是 GBN'''
+    if len(payload) < SYN_OPTION.size:
+        return MODE_GBN
+    return SYN_OPTION.unpack_from(payload)[0]
+
+
+def pack_syn_options(mode, filename=None):
+    '''SYN 的数据部分: 模式(1字节) + 可选的文件名'''
+    options = SYN_OPTION.pack(mode)
+    if filename:
+        options += filename.encode('utf-8')
+    return options
+
+
+def parse_filename(payload):
+    '''取出 SYN 中的文件名, 没有或无法解码时返回 None'''
+    try:
+        return bytes(payload[SYN_OPTION.size:]).decode('utf-8') or None
+    except UnicodeDecodeError:
+        return None
+
+
+def pack_sack(blocks):
+    '''把最多 MAX_SACK_BLOCKS 个 (start, end) 打包成 ACK 的数据部分'''
+    return b''.join(SACK_BLOCK.pack(start, end) for start, end in blocks[:MAX_SACK_BLOCKS])
+
+
+def unpack_sack(payload):
+    '''解析 ACK 数据部分中的 SACK 块'''
+    usable = len(payload) - len(payload) % SACK_BLOCK.size
+    return list(SACK_BLOCK.iter_unpack(payload[:usable]))
+
+
+class PacketBuilder:
+    '''在一个复用的 bytearray 里组包: pack_into 写 header, 数据直接写进缓冲区, 不产生新的 bytes
+
+    build 返回的 memoryview 只在下一次组包之前有效, 发送后不能再保存; 每个发送线程各用一个
+    '''
+
+    def __init__(self, size=MAX_PACKET_SIZE):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+
+    def payload_view(self, length):
+        '''返回缓冲区中数据部分的 memoryview, 调用方直接往里写, 再调用 finish'''
+        if HEADER_SIZE + length > len(self.buffer):
+            self.buffer = bytearray(HEADER_SIZE + length)
+            self.view = memoryview(self.buffer)
+        return self.view[HEADER_SIZE:HEADER_SIZE + length]
+
+    def finish(self, seq, ack, pkt_num, flags, length=0):
+        '''写入 header 并填上校验和, 返回整个数据包'''
+        packet = self.view[:HEADER_SIZE + length]
+        HEADER.pack_into(self.buffer, 0, seq, ack, pkt_num, flags)
+        # pack_into 之后校验和位还是 0, 直接对整个包算 CRC
+        FLAGS_FIELD.pack_into(self.buffer, FLAGS_OFFSET, flags | crc16(packet, CRC_INIT) & CHECKSUM_MASK)
+        return packet
+
+    def header(self, seq, ack, pkt_num, flags, payload):
+        '''只组 header, 校验和覆盖 header 和 payload; 配合 sendmsg 把两段一起发出, payload 不用拷贝进缓冲区'''
+        buffer = self.buffer
+        HEADER.pack_into(buffer, 0, seq, ack, pkt_num, flags)
+        header = self.view[:HEADER_SIZE]
+        crc = crc16(payload, crc16(header, CRC_INIT))
+        FLAGS_FIELD.pack_into(buffer, FLAGS_OFFSET, flags | crc & CHECKSUM_MASK)
+        return header
+
+    def build(self, seq, ack, pkt_num, flags, payload=b''):
+        '''组一个带数据的包, 与 payload_view + finish 等价; 每个包都会调用, 所以写在一个函数里'''
+        length = len(payload)
+        if HEADER_SIZE + length > len(self.buffer):
+            self.payload_view(length)
+        buffer = self.buffer
+        buffer[HEADER_SIZE:HEADER_SIZE + length] = payload  # 等长的切片赋值, 原地拷贝不改变缓冲区大小
+        HEADER.pack_into(buffer, 0, seq, ack, pkt_num, flags)
+        packet = self.view[:HEADER_SIZE + length]
+        FLAGS_FIELD.pack_into(buffer, FLAGS_OFFSET, flags | crc16(packet, CRC_INIT) & CHECKSUM_MASK)
+        return packet
+
+
+class BufferPool:
+    '''接收缓冲区池: 收包线程 acquire 一个 bytearray 用 recvfrom_into 收包, 处理完的线程 release 回池中复用'''
+
+    def __init__(self, buffer_size=MAX_PACKET_SIZE, count=64):
+        self.buffer_size = buffer_size
+        self.count = count
+        self.free = []  # 按需分配, 最多保留count个
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            if self.free:
+                return self.free.pop()
+        return bytearray(self.buffer_size)  # 池空了就临时分配
+
+    def release(self, buffer):
+        with self.lock:
+            if len(self.free) < self.count:  # 高峰时临时分配的缓冲区不长期占用内存
+                self.free.append(buffer)
@@ -0,0 +1,78 @@
+import math
+import threading
+import time
+
+# 哈希时间轮: 把时间分成固定长度的 tick, 轮子有 slots 个槽, 定时器按到期的 tick 放进对应的槽;
+# 超过一圈的定时器记下还要转几圈(rounds). 添加和取消都是 O(1), 每个 tick 只检查一个槽,
+# 适合大量连接各自有定时器(重发FIN、空闲超时、TIME_WAIT)且大多数定时器会被取消或推迟的场景
+
+
+class Timer:
+    __slots__ = ('rounds', 'action')
+
+    def __init__(self, rounds, callback, args):
+        self.rounds = rounds
+        self.action = (callback, args)  # 取消时整体置为 None, 其他线程读到的要么是完整的回调要么是 None
+
+    @property
+    def cancelled(self):
+        return self.action is None
+
+    def cancel(self):
+        '''只做标记, 转到它所在的槽时再丢弃; 先释放回调和参数, 被取消的定时器不会让连接对象多活一圈'''
+        self.action = None
+
+
+class TimerWheel:
+    '''schedule 可以在任何线程中调用; advance 由一个线程周期性调用, 到期的回调在该线程中执行'''
+
+    def __init__(self, tick=0.05, slots=512, clock=time.monotonic):
+        self.tick = tick
+        self.slots = slots
+        self.clock = clock
+        self.wheel = [[] for _ in range(slots)]
+        self.current = 0  # 最近处理过的槽
+        self.last_tick = clock()  # 最近处理过的 tick 的时间
+        self.lock = threading.Lock()
+
+    def schedule(self, delay, callback, *args):
+        '''delay 秒后(按 tick 向上取整, 至少一个 tick)调用 callback(*args), 返回可以 cancel 的 Timer'''
+        with self.lock:
+            # 从上次处理的 tick 算起, 加上 advance 还没赶上的时间, 保证不会提前触发
+            behind = self.clock() - self.last_tick
+            ticks = max(1, math.ceil((delay + behind) / self.tick))
+            timer = Timer((ticks - 1) // self.slots, callback, args)
+            self.wheel[(self.current + ticks) % self.slots].append(timer)
+        return timer
+
+    def advance(self):
+        '''处理到当前时间为止的所有 tick, 执行到期的回调, 返回执行的个数'''
+        due = []
+        with self.lock:
+            now = self.clock()
+            while now - self.last_tick >= self.tick:
+                self.last_tick += self.tick
+                self.current = (self.current + 1) % self.slots
+                bucket = self.wheel[self.current]
+                if not bucket:
+                    continue
+                keep = []
+                for timer in bucket:
+                    if timer.action is None:
+                        continue
+                    if timer.rounds:
+                        timer.rounds -= 1
+                        keep.append(timer)
+                    else:
+                        due.append(timer)
+                self.wheel[self.current] = keep
+        for timer in due:  # 在锁外执行, 回调里可以再 schedule
+            action = timer.action
+            if action is not None:
+                callback, args = action
+                callback(*args)
+        return len(due)
+
+    def __len__(self):
+        '''还没到期的定时器个数(包括已取消但还没丢弃的)'''
+        return sum(map(len, self.wheel))
@@ -0,0 +1,128 @@
+import asyncio
+import time
+
+from packet import PacketBuilder
+from udpserver import ACK_DELAY, FIN_RETRY_INTERVAL, Connection, build_parser, parse_args
+
+
+class AsyncConnection(Connection):
+    '''asyncio 版的连接: 状态机与线程版相同, 重发FIN和延迟ACK用 call_later 定时, 空闲时不占用任何线程和轮询'''
+
+    def __init__(self, server, client_addr):
+        super().__init__(server.transport, client_addr, server.loss_rate, server.corruption_rate,
+                         server.output_dir, server.builder, server.ack_every, server.ack_delay)
+        self.server = server
+        self.fin_timer = None
+        self.ack_timer = None
+
+    def start_fin_timer(self):
+        if self.fin_timer is not None:  # 重复的FIN会重新开始计时
+            self.fin_timer.cancel()
+        self.fin_timer = self.server.loop.call_later(FIN_RETRY_INTERVAL, self.on_fin_timer)
+
+    def on_fin_timer(self):
+        self.fin_timer = None
+        if not self.waiting_for_last_ack or not self.active:
+            return
+        if self.retry_fin():
+            self.fin_timer = self.server.loop.call_later(FIN_RETRY_INTERVAL, self.on_fin_timer)
+        else:
+            self.server.remove(self)
+
+    def start_ack_timer(self):
+        self.ack_timer = self.server.loop.call_later(self.ack_delay, self.on_ack_timer)
+
+    def cancel_ack_timer(self):
+        if self.ack_timer is not None:
+            self.ack_timer.cancel()
+            self.ack_timer = None
+
+    def on_ack_timer(self):
+        self.ack_timer = None
+        super().on_ack_timer()
+
+    def close(self):
+        super().close()
+        if self.fin_timer is not None:
+            self.fin_timer.cancel()
+            self.fin_timer = None
+        self.cancel_ack_timer()
+        self.close_output()
+
+
+class AsyncUDPServer(asyncio.DatagramProtocol):
+    '''基于 asyncio 的 UDP 服务器: 一个事件循环处理全部客户端, 每个客户端只是一个 AsyncConnection 对象, 协议与线程版完全一致'''
+
+    def __init__(self, loss_rate=0.2, corruption_rate=0.05, output_dir=None, ack_every=1, ack_delay=ACK_DELAY):
+        self.loss_rate = loss_rate
+        self.corruption_rate = corruption_rate
+        self.output_dir = output_dir
+        self.ack_every = ack_every
+        self.ack_delay = ack_delay
+        self.connections = {}  # 客户端地址 -> AsyncConnection
+        self.builder = PacketBuilder()  # 所有连接都在事件循环线程中组包, 共用一个缓冲区
+        self.loop = None
+        self.transport = None
+        self.closed = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.loop = asyncio.get_running_loop()
+        self.closed = self.loop.create_future()
+
+    def datagram_received(self, data, addr):
+        conn = self.connections.get(addr)
+        if conn is None:
+            conn = self.connections[addr] = AsyncConnection(self, addr)
+        conn.process_packet(memoryview(data))
+        if not conn.active:
+            self.remove(conn)
+
+    def remove(self, conn):
+        conn.close()
+        if self.connections.get(conn.client_addr) is conn:
+            del self.connections[conn.client_addr]
+        print(f"与{conn.client_addr}的连接已关闭, 收到 {conn.total_packets} 个数据包, 发送 {conn.acks_sent} 个 ACK, "
+              f"当前连接数: {len(self.connections)}")
+
+    def error_received(self, exc):
+        # 对端端口不可达等 ICMP 错误会出现在这里, 不影响其他连接
+        print(f"[{time.strftime('%H:%M:%S')}] socket 错误: {exc}")
+
+    def connection_lost(self, exc):
+        for conn in list(self.connections.values()):
+            conn.close()
+        self.connections.clear()
+        if self.closed is not None and not self.closed.done():
+            self.closed.set_result(None)
+
+
+async def serve(port, loss_rate=0.2, corruption_rate=0.05, output_dir=None, host='0.0.0.0', reuse_port=False,
+                ack_every=1, ack_delay=ACK_DELAY):
+    loop = asyncio.get_running_loop()
+    transport, server = await loop.create_datagram_endpoint(
+        lambda: AsyncUDPServer(loss_rate, corruption_rate, output_dir, ack_every, ack_delay), local_addr=(host, port),
+        reuse_port=reuse_port or None)
+    print(f"UDP 服务器(asyncio)启动, 端口: {port}, 丢包率: {loss_rate * 100}%")
+    if output_dir is not None:
+        print(f"收到的数据保存到 {output_dir}")
+    try:
+        await server.closed
+    finally:
+        transport.close()
+
+
+def run_server(port, loss_rate=0.2, corruption_rate=0.05, output_dir=None, reuse_port=False, ack_every=1,
+               ack_delay=ACK_DELAY):
+    try:
+        asyncio.run(serve(port, loss_rate, corruption_rate, output_dir, reuse_port=reuse_port, ack_every=ack_every,
+                          ack_delay=ack_delay))
+    except KeyboardInterrupt:
+        print("\n服务器关闭中...")
+
+
+if __name__ == '__main__':
+    args = parse_args(build_parser("asyncio 版基于UDP的可靠传输服务器, 单线程处理全部客户端", 'udpasyncserver.py',
+                                   thread_options=False))
+    run_server(args.port, args.loss_rate, args.corruption_rate, args.output_dir, ack_every=args.ack_every,
+               ack_delay=args.ack_delay)
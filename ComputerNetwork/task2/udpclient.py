@@ -1,95 +1,54 @@
+import argparse
+import mmap
+import os
 import socket
 import struct
 import random #用于模拟丢包
-import sys
 import time
-import threading
-import queue
 import pandas as pd
-from isapi.isapicon import HSE_EXEC_URL_DISABLE_CUSTOM_ERROR
-
-# 我的header格式
-#! 网络协议 大端
-# 序列号 I (4B)
-# 确认号 I (4B)
-# 分组号 I (4B)
-# 标志位 4bit
-# 校验和 12 bit 两者一共 2 B
-HEADER_FORMAT = '!III H'
-HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
-# print(HEADER_SIZE) #14
-
-#标志位 这里我们只用高4位 低12位用于checksum
-mySYN = 0x8000 #1000 0000 0000 0000
-myACK = 0x4000 #0100 0000 0000 0000
-myFIN = 0x2000 #0010 0000 0000 0000
-myDATA = 0x1000 #0001 0000 0000 0000
-
-def crc_checksum(data: bytes, poly=0x1021, init=0xFFFF) -> int:
-    '''实现校验和计算 CRC 冗余校验'''
-    #poly 为生成多项式 data 是 10个字节
-    crc = init # 1111 1111 1111 1111
-    for byte in data:
-        crc ^= byte << 8  # 将byte移到高8位
-        for _ in range(8):
-            if (crc & 0x8000):  # 如果最高位是1
-                crc = (crc << 1) ^ poly
-            else:
-                crc <<= 1
-            crc &= 0xFFFF
-    return crc & 0x0FFF
-
-
-def create_packet(seq,ack,pkt_num,flags,payload = b''):
-    '''创建header'''
-    #先创建不带校验和的头部
-    header_without_checksum = struct.pack(HEADER_FORMAT, seq,ack,pkt_num,flags) #二进制字节流（bytes)
-    checksum = crc_checksum(header_without_checksum + payload)
-    # print(header_without_checksum)
-    flags_with_checksum  = flags | checksum
-
-    packet = struct.pack(HEADER_FORMAT, seq, ack, pkt_num,flags_with_checksum)
-    packet += payload
-    return packet
-
-def unpack_header(header):
-    '''解析header'''
-    seq,ack,pkt_num,flags_with_checksum = struct.unpack(HEADER_FORMAT, header)
-    flags = flags_with_checksum & 0xF000
-    checksum = flags_with_checksum & 0x0FFF
-    return seq,ack,pkt_num,flags,checksum
-
-def verify_checksum(data):
-
-    '''验证校验和'''
-    #对方发过来的checksum 我自己算一遍检查一下
-
-    if len(data) < HEADER_SIZE:
-        return False
-
-    #解析头部
-    seq,ack,pkt_num,flags_with_checksum =struct.unpack(HEADER_FORMAT, data[:HEADER_SIZE])
-    recv_flags = flags_with_checksum & 0xF000
-    recv_checksum = flags_with_checksum & 0x0FFF
+from batchio import BatchReceiver, BatchSender
+from congestion import ALGORITHMS, MSS, create_congestion_control
+from packet import (HEADER_SIZE, MAX_PACKET_SIZE, MAX_PAYLOAD, MODE_GBN, MODE_NAMES, MODE_SR, PacketBuilder,
+                    create_packet, myACK, myDATA, myFIN, mySYN, pack_syn_options, parse_mode, unpack_header,
+                    unpack_sack, verify_checksum) # header格式和组包/校验见 packet.py
 
-    #对收到的进行打包
-    header_without_checksum = struct.pack(HEADER_FORMAT, seq, ack,pkt_num, recv_flags)
+PKT_NUM = struct.Struct('!I')  # 模拟数据的前4字节是分组号
+ZEROS = memoryview(bytes(MAX_PACKET_SIZE))
+DEFAULT_FILE_MSS = 1400  # 传文件时默认的分段大小: 加上 header、UDP 和 IP 头不超过以太网的 1500 字节 MTU
+MAX_FILE_SIZE = 0xffffffff  # 序列号是4字节的文件偏移
+ACK_BUFFER_SIZE = 2048  # ACK 只有 header 和最多4个 SACK 块
+LINGER = 30  # 发出第四次挥手的ACK后继续等待的秒数, 服务器没收到ACK重发FIN时再回一次
 
-    #自己计算一下校验和
-    cal_checksum = crc_checksum(header_without_checksum + data[HEADER_SIZE:])
-    # print(cal_checksum ,recv_checksum)
-    return cal_checksum == recv_checksum
 
 class GBNClient:
-    def __init__(self, server_ip, server_port , total_packets=30, window_size=400):
+    def __init__(self, server_ip, server_port , total_packets=30, window_size=400, mode=MODE_GBN, congestion='fixed',
+                 file_path=None, mss=DEFAULT_FILE_MSS, batch_io=True, linger=LINGER, save_stats=True, seed=None):
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.server_address = (server_ip, server_port)
-        self.total_packets = total_packets
         self.window_size = window_size
+
+        # 文件传输: 用 mmap 映射整个文件, 按 mss 切分, 每段的序列号就是它在文件中的偏移, 发送和重传都直接从映射中取数据
+        self.file_path = file_path
+        self.file_size = 0
+        self.file_map = None
+        self.file_view = None
+        if file_path is not None:
+            self.open_file(file_path)
+            self.mss = mss
+            total_packets = (self.file_size + mss - 1) // mss
+        else:
+            self.mss = MSS  # 模拟数据的包是 40~80 字节
+        self.total_packets = total_packets
+        # 拥塞控制: fixed 时窗口固定为 window_size, reno/cubic 根据ACK、重复ACK和超时调整窗口; 窗口至少能放下一个 mss
+        self.cc = create_congestion_control(congestion, window_size if congestion == 'fixed' else None, self.mss)
         self.base = 0
-        self.next_seq = 0
+        self.next_seq = 0  # 下一个要发送的字节, 即已发送的最高字节+1
         self.client_isn = random.randint(0, 0xffffffff)
+        self.rng = random.Random(seed)  # 模拟数据的包长, 固定 seed 时每次运行发送的字节数相同
         self.packets = {}  # 存储所有发送的包
+        self.unacked = {}  # 还没确认的包, 按发送顺序排列, 确认和超时检查只需要遍历它
+        self.mode = mode  # 想要使用的模式, 握手时和服务器协商
+        self.selective = False  # 协商结果: True 为选择重传, 每个包单独计时, 只重传没收到的包
         self.rtt_list = []
 
         self.total_sent = 0 #存储总的发送包个数
@@ -97,12 +56,53 @@ class GBNClient:
         self.dev_rtt = 0
         self.timeout = 0.3
         self.conn_established = False
+
+        # 快速重传: 连续收到3个重复ACK就立即重传缺失的包, 不等超时
+        self.dup_ack_threshold = 3
+        self.dup_acks = 0
+        self.in_recovery = False  # 快速恢复阶段(NewReno): 直到进入恢复时已发出的数据全部确认才退出
+        self.recover = 0  # 进入快速恢复时的 next_seq
+        self.fast_retransmits = 0
+        self.timeouts = 0
+
+        self.builder = PacketBuilder()  # 数据包在复用的缓冲区里组装
+        self.recv_buffer = bytearray(MAX_PACKET_SIZE)  # recvfrom_into 复用的接收缓冲区
+        self.recv_view = memoryview(self.recv_buffer)
+        # 批量I/O: 一个窗口的数据包攒齐后用一次 sendmmsg 发出, 已到达的ACK用一次 recvmmsg 收完; 不支持时退回 sendto/recvfrom
+        batched = None if batch_io else False
+        self.sender = BatchSender(self.sock, buffer_size=HEADER_SIZE + self.mss, batched=batched)
+        self.receiver = BatchReceiver(self.sock, buffer_size=ACK_BUFFER_SIZE, batched=batched)
+        self.transfer_start = self.transfer_end = None
+        self.connect_start = self.close_time = None  # 从发出SYN到四次挥手完成, 不含最后的等待
+        self.linger = linger
+        self.save_stats = save_stats  # False 时不写 rtt_stats.csv 和 cwnd_stats.csv, 用 summary() 取结果
         # self.ack_count = {}
-        print(f"客户端启动, 将发送 {total_packets} 个数据包, 窗口大小: {window_size} 字节")
+        if file_path is not None:
+            print(f"文件传输模式: {file_path} ({self.file_size} 字节), 分段大小 {self.mss} 字节, "
+                  f"共 {total_packets} 个数据包")
+        print(f"客户端启动, 将发送 {total_packets} 个数据包, 拥塞控制: {self.cc.name}, 初始窗口: {self.cc.window} 字节")
+
+    def open_file(self, file_path):
+        with open(file_path, 'rb') as f:
+            self.file_size = os.fstat(f.fileno()).st_size
+            if self.file_size > MAX_FILE_SIZE:
+                raise ValueError(f"文件超过 {MAX_FILE_SIZE} 字节, 序列号放不下")
+            if self.file_size:  # 空文件不能 mmap
+                self.file_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self.file_view = memoryview(self.file_map)
+
+    def close_file(self):
+        if self.file_view is not None:
+            self.file_view.release()
+            self.file_map.close()
+            self.file_view = self.file_map = None
 
     def three_handshake(self):
         '''三次握手'''
-        header = create_packet(self.client_isn, 0, 0,mySYN) #控制包（SYN/ACK/FIN）：packet_num设为0
+        #控制包（SYN/ACK/FIN）：packet_num设为0; 使用选择重传或传文件时SYN的数据部分带上模式和文件名, 否则不带, 与旧服务器完全兼容
+        filename = os.path.basename(self.file_path) if self.file_path is not None else None
+        options = pack_syn_options(self.mode, filename) if self.mode != MODE_GBN or filename else b''
+        header = create_packet(self.client_isn, 0, 0,mySYN, options)
         self.sock.sendto(header, self.server_address) #发送FIN 第一次握手
         current_time = time.strftime("%H:%M:%S")
         print(f"[{current_time}] 发送 SYN (seq={self.client_isn})")
@@ -111,7 +111,7 @@ class GBNClient:
         while True:
             try:
                 self.sock.settimeout(2)
-                data, addr = self.sock.recvfrom(1024)
+                data = self.recv()
                 if not verify_checksum(data):
                     print(f"[{current_time}] 校验和失败, 丢弃数据包")
                     continue
@@ -120,8 +120,11 @@ class GBNClient:
                 if flags & mySYN and flags & myACK and ack == self.client_isn + 1:
                     handshake_rtt = (time.time() - start_time) * 1000
                     server_time = time.strftime("%H:%M:%S")
+                    # 服务器不支持(SYN-ACK不带数据)时退回GBN
+                    self.selective = self.mode == MODE_SR and parse_mode(data[HEADER_SIZE:]) == MODE_SR
                     print(
                         f"[{current_time}] 收到 SYN-ACK, seq={seq}, ack={ack}, RTT={handshake_rtt:.2f}ms, 服务器时间: {server_time}")
+                    print(f"[{current_time}] 传输模式: {'选择重传(SR)' if self.selective else 'GBN'}")
                     break
             except socket.timeout:
                 current_time = time.strftime("%H:%M:%S")
@@ -135,30 +138,36 @@ class GBNClient:
         self.conn_established = True
 
     def run(self):
+        self.connect_start = time.time()
         self.three_handshake()
 
-        print(f"\n开始数据传输, 固定窗口大小: {self.window_size} 字节")
+        print(f"\n开始数据传输, 拥塞控制: {self.cc.name}, 窗口大小: {self.cc.window} 字节")
         packet_num = 1
         window_end = self.base
+        pending_size = None  # 已经抽好但放不进窗口的包长, 留到下一轮发送, 这样每个包的长度只由 seed 和包号决定
+        self.transfer_start = time.time()
 
         while packet_num <= self.total_packets or window_end > self.base: #使用类似tcp的窗口滑动,便于处理不同大小的包
             packets_in_window = 0
+            self.window_size = self.cc.window  # 每轮按拥塞控制算法给出的当前窗口发送
             while window_end < self.base + self.window_size and packet_num <= self.total_packets:
-                packet_size = random.randint(40, 80)
+                if self.file_view is not None:
+                    packet_size = min(self.mss, self.file_size - window_end)  # 最后一段可能不满 mss
+                else:
+                    if pending_size is None:
+                        pending_size = self.rng.randint(40, 80)
+                    packet_size = pending_size
 
                 if window_end + packet_size > self.base + self.window_size: #超过窗口就不发了
                     break
+                pending_size = None
 
                 start_byte = window_end
                 end_byte = window_end + packet_size - 1
                 window_end = end_byte + 1
+                self.next_seq = window_end
 
-                #模拟封装的数据
-                payload = struct.pack('!I', packet_num) + b'\0' * (packet_size - 4)
-                packet = create_packet(start_byte, 0, packet_num,myDATA,payload)
-
-                self.sock.sendto(packet, self.server_address)
-                self.total_sent += 1
+                self.send_data(start_byte, packet_num, packet_size)
 
                 sent_time = time.time()
                 self.packets[packet_num] = {
@@ -170,6 +179,7 @@ class GBNClient:
                     'rtt': None,  # 初始无RTT值
                     'ack_time': None  # 添加确认时间字段
                 }
+                self.unacked[packet_num] = self.packets[packet_num]
 
                 current_time = time.strftime("%H:%M:%S")
                 print(f"[{current_time}] 发送包 {packet_num} ({start_byte}~{end_byte}字节), "
@@ -181,24 +191,13 @@ class GBNClient:
             if packets_in_window > 0:
                 print(f"当前窗口发送包数: {packets_in_window}, 使用字节: {window_end - self.base}")
 
-            self.receive_ack() #接收ack
-
-            unacked_packets = [p for p in self.packets.values() if not p['acked']] #重传 超时重传
-            if unacked_packets:
-                oldest_time = min(p['sent_time'] for p in unacked_packets)
-                if time.time() - oldest_time > self.timeout:
-                    current_time = time.strftime("%H:%M:%S")
-                    print(f"[{current_time}] 超时 ({self.timeout * 1000:.0f}ms), 重传窗口中所有数据包")
-
-                    for pkt_num, info in self.packets.items():
-                        if not info['acked']:
-                            payload = struct.pack('!I', pkt_num) + b'\0' * (info['size'] - 4)
-                            packet = create_packet(info['start'], 0,pkt_num,myDATA,payload)
-
-                            self.sock.sendto(packet, self.server_address)
-                            self.total_sent += 1
-                            info['sent_time'] = time.time()
-                            print(f"重传包 {pkt_num} ({info['start']}~{info['end']}字节)")
+            self.sender.flush()  # 本轮的新包和上一轮的重传包一次发出
+            if self.receive_ack(): #接收ack
+                while self.receive_ack(0): #窗口大时一轮会回来很多ACK, 把已经到达的都处理完再发送
+                    pass
+            self.retransmit_timeouts() #超时重传
+        self.sender.flush()
+        self.transfer_end = time.time()
         '''四次挥手'''
         fin_seq = window_end
         header = create_packet(fin_seq , 0,0, myFIN)
@@ -210,7 +209,7 @@ class GBNClient:
         while True:
             try:
                 self.sock.settimeout(1)
-                data, addr = self.sock.recvfrom(1024)
+                data = self.recv()
                 if not verify_checksum(data[:HEADER_SIZE]):
                     print("Error:  校验和失败, 丢弃数据包 ")
                     continue
@@ -226,7 +225,7 @@ class GBNClient:
         while True:
             try:
                 self.sock.settimeout(5)
-                data, addr = self.sock.recvfrom(1024)
+                data = self.recv()
                 if not verify_checksum(data[:HEADER_SIZE]):
                     continue
                 seq, ack, pkt_num,flags, _ = unpack_header(data[:HEADER_SIZE])
@@ -240,14 +239,15 @@ class GBNClient:
             except socket.timeout:
                 print(f"[{current_time}] 等待 FIN 超时，继续等待...")
 
+        self.close_time = time.time()
         self.print_stats()
         t1 = time.time()
-        print("等待最后30s,避免服务器未收到第四次挥手的ACK!")
-        while time.time() - t1 < 30:
+        print(f"等待最后{self.linger}s,避免服务器未收到第四次挥手的ACK!")
+        while time.time() - t1 < self.linger:
             #处理没收到服务器最后一个ack
             # print("等待最后30s,避免服务器未收到第四次挥手的ACK!")
             try:
-                data, addr = self.sock.recvfrom(1024)
+                data = self.recv()
             except socket.timeout:
                 # 超时没收到包，继续循环检查时间是否超时
                 continue
@@ -263,72 +263,200 @@ class GBNClient:
                 print(f"[{current_time}] 再次发送 ACK（第四次挥手）")
                 t1 = time.time()
         self.sock.close()
+        self.close_file()
         print("连接已关闭!")
 
-    def receive_ack(self):
+    def recv(self):
+        '''收一个包到复用的缓冲区, 返回的memoryview只在下一次recv之前有效'''
+        n, addr = self.sock.recvfrom_into(self.recv_buffer)
+        return self.recv_view[:n]
+
+    def build_data_packet(self, start_byte, pkt_num, size):
+        '''模拟数据: 前4字节是分组号, 其余填0, 直接写进组包缓冲区'''
+        payload = self.builder.payload_view(size)
+        PKT_NUM.pack_into(payload, 0, pkt_num)
+        payload[4:] = ZEROS[:size - 4]
+        return self.builder.finish(start_byte, 0, pkt_num, myDATA, size)
+
+    def send_data(self, start_byte, pkt_num, size):
+        '''发送一个数据包, 首次发送和重传都用它; 传文件时数据取自 mmap, header 和数据分两段交给 sender, 不先拼成一个包'''
+        self.total_sent += 1
+        if self.file_view is None:
+            #模拟封装的数据
+            packet = self.build_data_packet(start_byte, pkt_num, size)
+        else:
+            payload = self.file_view[start_byte:start_byte + size]
+            packet = (self.builder.header(start_byte, 0, pkt_num, myDATA, payload), payload)
+        self.sender.send(packet, self.server_address)  # 批量发送时先拷进发送队列, flush 时一起发出
+
+    def retransmit(self, pkt_num, info):
+        self.send_data(info['start'], pkt_num, info['size'])
+        info['sent_time'] = time.time()
+        print(f"重传包 {pkt_num} ({info['start']}~{info['end']}字节)")
+
+    def retransmit_timeouts(self):
+        '''GBN: 最早的未确认包超时就重传窗口中所有未确认的包; 选择重传: 每个包单独计时, 只重传超时的包'''
+        if not self.unacked:
+            return
+        now = time.time()
+        if self.selective:
+            expired = [(pkt_num, info) for pkt_num, info in self.unacked.items()
+                       if now - info['sent_time'] > self.timeout]
+            if expired:
+                self.on_timeout()
+                current_time = time.strftime("%H:%M:%S")
+                print(f"[{current_time}] 超时 ({self.timeout * 1000:.0f}ms), 重传 {len(expired)} 个未确认的数据包")
+                for pkt_num, info in expired:
+                    self.retransmit(pkt_num, info)
+            return
+
+        oldest_time = min(p['sent_time'] for p in self.unacked.values())
+        if now - oldest_time > self.timeout:
+            self.on_timeout()
+            current_time = time.strftime("%H:%M:%S")
+            print(f"[{current_time}] 超时 ({self.timeout * 1000:.0f}ms), 重传窗口中所有数据包")
+            for pkt_num, info in list(self.unacked.items()):
+                self.retransmit(pkt_num, info)
+
+    def receive_ack(self, timeout=0.1):
+        '''最多等待timeout秒, 接收并处理已经到达的ACK(批量I/O时一次最多64个), 没有收到任何包时返回False'''
         try:
-            self.sock.settimeout(0.1)
-            data, addr = self.sock.recvfrom(1024)
-            if len(data) < HEADER_SIZE:
-                return False
+            self.sock.settimeout(timeout)
+            messages = self.receiver.recv()
+        except (socket.timeout, BlockingIOError):  # timeout为0时没有数据会抛出 BlockingIOError
+            return False
+        for data, addr in messages:
+            self.process_ack(data)
+        return True
+
+    def process_ack(self, data):
+        '''处理一个ACK: 校验、SACK、累计确认和重复ACK'''
+        if len(data) < HEADER_SIZE:
+            return
+
+        if not verify_checksum(data):
+            print("Error: 校验和失败, 丢弃数据包!")
+            return
+
+        seq, ack, pkt_num,flags, checksum = unpack_header(data[:HEADER_SIZE])
+        current_time = time.strftime("%H:%M:%S")
+        server_time = time.strftime("%H:%M:%S")
+
+        if flags & myACK:
+            if self.selective:
+                # SACK块里完整收到的包单独确认, 之后超时也不会再重传
+                for block_start, block_end in unpack_sack(data[HEADER_SIZE:]):
+                    for pkt_num, info in list(self.unacked.items()):
+                        if info['start'] >= block_end:
+                            break
+                        if info['start'] >= block_start and info['end'] < block_end:
+                            self.mark_acked(pkt_num, info, current_time, server_time, '已被SACK确认')
+            if ack > self.base:
+                for pkt_num, info in list(self.unacked.items()):
+                    if info['end'] >= ack:
+                        break  # unacked 按字节顺序排列, 后面的都还没确认
+                    self.mark_acked(pkt_num, info, current_time, server_time)
+                acked_bytes = ack - self.base
+                self.base = ack
+                self.on_new_ack(ack, acked_bytes, current_time)
+            elif ack == self.base and self.unacked:
+                self.on_duplicate_ack(current_time)
+
+    def on_duplicate_ack(self, current_time):
+        '''重复ACK说明base处的包丢了而后面的包到了; 第3个重复ACK时立即重传并进入快速恢复
+
+        选择重传只重传base处缺失的那个包; GBN的接收方已经丢弃了缺口之后的所有包, 所以从base开始回退重传整个窗口。
+        快速恢复期间不再因重复ACK触发重传(这些重复ACK来自重传前已经发出的包)
+        '''
+        self.dup_acks += 1
+        if self.dup_acks != self.dup_ack_threshold or self.in_recovery:
+            return
+        self.in_recovery = True
+        self.recover = self.next_seq
+        self.cc.on_fast_retransmit(self.next_seq - self.base)
+        self.fast_retransmits += 1
+        print(f"[{current_time}] 收到 {self.dup_acks} 个重复 ACK(ack={self.base}), 快速重传并进入快速恢复, "
+              f"恢复点 {self.recover}")
+        if self.selective:
+            self.retransmit_first_unacked()
+        else:
+            for pkt_num, info in list(self.unacked.items()):
+                self.retransmit(pkt_num, info)
+
+    def on_new_ack(self, ack, acked_bytes, current_time):
+        '''确认了新数据; 快速恢复中 ack >= recover 时退出恢复
+
+        选择重传时的部分确认(ack < recover)说明下一个缺口处的包也丢了, 像 NewReno 一样立即重传它, 不再等3个重复ACK;
+        GBN 回退重传的包还在路上, 部分确认只说明它们正在按序到达, 不需要处理
+        '''
+        self.dup_acks = 0
+        if not self.in_recovery:
+            self.cc.on_ack(acked_bytes, self.estimated_rtt)
+            return
+        if ack >= self.recover:
+            self.in_recovery = False
+            self.cc.on_recovery_exit()
+            print(f"[{current_time}] 恢复点之前的数据已全部确认, 退出快速恢复")
+        elif self.selective:
+            print(f"[{current_time}] 快速恢复中收到部分确认 ack={ack}, 重传下一个缺失的包")
+            self.fast_retransmits += 1
+            self.retransmit_first_unacked()
+
+    def on_timeout(self):
+        '''超时重传时放弃快速恢复, 重复ACK重新计数'''
+        self.timeouts += 1
+        self.dup_acks = 0
+        self.in_recovery = False
+        self.cc.on_timeout(self.next_seq - self.base)
+
+    def retransmit_first_unacked(self):
+        # 选择重传时 SACK 确认过的包已经不在 unacked 里, 第一个就是真正缺失的包
+        for pkt_num, info in self.unacked.items():
+            self.retransmit(pkt_num, info)
+            return
 
-            if not verify_checksum(data):
-                print("Error: 校验和失败, 丢弃数据包!")
-                return False
+    def mark_acked(self, pkt_num, info, current_time, server_time, how='已确认'):
+        '''标记一个包已确认, 记录RTT并更新超时时间'''
+        ack_time = time.time()
+        rtt = (ack_time - info['sent_time']) * 1000
+        self.rtt_list.append(rtt)
+
+        # 更新包信息
+        info['acked'] = True
+        info['rtt'] = rtt
+        info['ack_time'] = ack_time
+        self.unacked.pop(pkt_num, None)
+
+        start_byte = info['start']
+        end_byte = info['end']
+        print(
+            f"[{current_time}] 包 {pkt_num} ({start_byte}~{end_byte}字节) {how}, "
+            f"RTT={rtt:.2f}ms, 服务器时间: {server_time}")
+
+        # if len(self.rtt_list) >= 5:
+        #     avg_rtt = pd.Series(self.rtt_list[-5:]).mean()
+        #     self.timeout = max(0.05, min(1.0, 5 * avg_rtt / 1000))
+        #     print(
+        #         f"[{current_time}] 更新超时时间为 {self.timeout * 1000:.0f}ms (平均RTT: {avg_rtt:.2f}ms)")
+        #模拟书上的超时重传
+        if info['rtt'] is not None:
+            sample_rtt = info['rtt'] / 1000  # 转换为秒
+            if self.estimated_rtt is None:
+                self.estimated_rtt = sample_rtt
+                self.dev_rtt = sample_rtt / 2
+            else:
+                alpha = 0.125
+                beta = 0.25
+                self.estimated_rtt = (1 - alpha) * self.estimated_rtt + alpha * sample_rtt
+                self.dev_rtt = (1 - beta) * self.dev_rtt + beta * abs(
+                    sample_rtt - self.estimated_rtt)
+
+            self.timeout = max(0.005,
+                               min(1.0, self.estimated_rtt + 4 * self.dev_rtt))  # 0.05s最小，1s最大限制
 
-            seq, ack, pkt_num,flags, checksum = unpack_header(data[:HEADER_SIZE])
             current_time = time.strftime("%H:%M:%S")
-            server_time = time.strftime("%H:%M:%S")
-
-            if flags & myACK:
-                if ack > self.base:
-                    for pkt_num, info in self.packets.items():
-                        if info['end'] < ack and not info['acked']:
-                            ack_time = time.time()
-                            rtt = (ack_time - info['sent_time']) * 1000
-                            self.rtt_list.append(rtt)
-
-                            # 更新包信息
-                            info['acked'] = True
-                            info['rtt'] = rtt
-                            info['ack_time'] = ack_time
-
-                            start_byte = info['start']
-                            end_byte = info['end']
-                            print(
-                                f"[{current_time}] 包 {pkt_num} ({start_byte}~{end_byte}字节) 已确认, "
-                                f"RTT={rtt:.2f}ms, 服务器时间: {server_time}")
-
-                            # if len(self.rtt_list) >= 5:
-                            #     avg_rtt = pd.Series(self.rtt_list[-5:]).mean()
-                            #     self.timeout = max(0.05, min(1.0, 5 * avg_rtt / 1000))
-                            #     print(
-                            #         f"[{current_time}] 更新超时时间为 {self.timeout * 1000:.0f}ms (平均RTT: {avg_rtt:.2f}ms)")
-                            #模拟书上的超时重传
-                            if info['rtt'] is not None:
-                                sample_rtt = info['rtt'] / 1000  # 转换为秒
-                                if self.estimated_rtt is None:
-                                    self.estimated_rtt = sample_rtt
-                                    self.dev_rtt = sample_rtt / 2
-                                else:
-                                    alpha = 0.125
-                                    beta = 0.25
-                                    self.estimated_rtt = (1 - alpha) * self.estimated_rtt + alpha * sample_rtt
-                                    self.dev_rtt = (1 - beta) * self.dev_rtt + beta * abs(
-                                        sample_rtt - self.estimated_rtt)
-
-                                self.timeout = max(0.005,
-                                                   min(1.0, self.estimated_rtt + 4 * self.dev_rtt))  # 0.05s最小，1s最大限制
-
-                                current_time = time.strftime("%H:%M:%S")
-                                print(f"[{current_time}] 超时调整: EstRTT={self.estimated_rtt * 1000:.2f}ms, "
-                                      f"DevRTT={self.dev_rtt * 1000:.2f}ms -> Timeout={self.timeout * 1000:.2f}ms")
-
-                    self.base = ack
-                    return True
-        except socket.timeout:
-            pass
-        return False
+            print(f"[{current_time}] 超时调整: EstRTT={self.estimated_rtt * 1000:.2f}ms, "
+                  f"DevRTT={self.dev_rtt * 1000:.2f}ms -> Timeout={self.timeout * 1000:.2f}ms")
 
     def print_stats(self):
         if not self.rtt_list:
@@ -349,12 +477,24 @@ class GBNClient:
 
         print("\n【传输统计汇总】")
         print(f"总发送包数: {self.total_sent}")
+        print(f"快速重传次数: {self.fast_retransmits}, 超时次数: {self.timeouts}")
+        io_mode = '批量(sendmmsg/recvmmsg)' if self.sender.batched else '逐包(sendto/recvfrom)'
+        print(f"I/O方式: {io_mode}, 发送 {self.sender.datagrams} 个数据报用了 {self.sender.syscalls} 次系统调用, "
+              f"接收 {self.receiver.datagrams} 个ACK用了 {self.receiver.syscalls} 次系统调用")
         print(f"总接收包数: {self.total_packets}")
         print(f"丢包率: {loss_rate:.4f} ")
         print(f"最大RTT: {s.max():.2f} ms")
         print(f"最小RTT: {s.min():.2f} ms")
         print(f"平均RTT: {s.mean():.2f} ms")
         print(f"RTT标准差: {s.std():.2f} ms")
+        if self.file_path is not None and self.transfer_end is not None:
+            elapsed = self.transfer_end - self.transfer_start
+            goodput = self.file_size / elapsed if elapsed > 0 else 0.0
+            print(f"文件 {self.file_size} 字节, 数据传输用时 {elapsed:.3f} s, 有效吞吐量 {goodput / 1024:.1f} KB/s "
+                  f"({goodput * 8 / 1e6:.3f} Mbit/s)")
+
+        if not self.save_stats:
+            return
 
         # 创建包含所有包RTT的数据框
         rtt_data = []
@@ -370,18 +510,68 @@ class GBNClient:
         print("\nRTT统计数据已保存到 rtt_stats.csv")
         print(f"已确认包数: {len(confirmed_rtts)}, CSV记录数: {len(rtt_data)}")
 
+        # 拥塞窗口随时间的变化
+        cwnd_df = pd.DataFrame(self.cc.history, columns=['时间(s)', 'cwnd', 'ssthresh', '事件'])
+        cwnd_df.to_csv('cwnd_stats.csv', index=False)
+        print(f"拥塞窗口变化已保存到 cwnd_stats.csv, 共 {len(cwnd_df)} 条, 最终窗口: {self.cc.window} 字节")
+
+
+    def summary(self):
+        '''一次传输的结果汇总, 供 gbnbench.py 等程序使用; RTT 单位为毫秒'''
+        elapsed = self.transfer_end - self.transfer_start if self.transfer_end is not None else None
+        data_bytes = self.file_size if self.file_path is not None else self.next_seq
+        s = pd.Series(self.rtt_list, dtype=float)
+        return {
+            'packets': self.total_packets,
+            'bytes': data_bytes,
+            'sent': self.total_sent,
+            'retransmissions': self.total_sent - self.total_packets,
+            'retx_ratio': (self.total_sent - self.total_packets) / self.total_packets if self.total_packets else 0.0,
+            'fast_retransmits': self.fast_retransmits,
+            'timeouts': self.timeouts,
+            'elapsed_s': elapsed,
+            'completion_s': self.close_time - self.connect_start if self.close_time is not None else None,
+            'goodput_kbps': data_bytes * 8 / elapsed / 1000 if elapsed else None,
+            'rtt_p50_ms': s.quantile(0.5) if len(s) else None,
+            'rtt_p90_ms': s.quantile(0.9) if len(s) else None,
+            'rtt_p99_ms': s.quantile(0.99) if len(s) else None,
+            'rtt_max_ms': s.max() if len(s) else None,
+        }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="基于UDP的可靠传输客户端")
+    parser.add_argument('server_ip', help="服务器地址")
+    parser.add_argument('server_port', type=int, help="服务器端口")
+    parser.add_argument('total_packets', nargs='?', type=int, default=30, help="数据包总数")
+    parser.add_argument('--mode', choices=list(MODE_NAMES), default='gbn',
+                        help="gbn: 回退N步; sr: 选择重传(服务器不支持时自动退回gbn)")
+    parser.add_argument('--cc', choices=list(ALGORITHMS), default='fixed',
+                        help="拥塞控制算法: fixed 固定窗口, reno 慢启动+AIMD, cubic")
+    parser.add_argument('--window', type=int, default=400, help="fixed 时的固定窗口大小(字节)")
+    parser.add_argument('--file', help="发送这个文件而不是模拟数据, 此时忽略数据包总数")
+    parser.add_argument('--no-batch', action='store_true', help="不使用 sendmmsg/recvmmsg 批量收发, 每个包一次系统调用")
+    parser.add_argument('--mss', type=int, default=DEFAULT_FILE_MSS,
+                        help=f"传文件时每个数据包的数据部分大小(字节), 最大 {MAX_PAYLOAD}")
+    parser.add_argument('--seed', type=int, help="模拟数据包长的随机数种子, 不指定时每次不同")
+    parser.add_argument('--linger', type=float, default=LINGER,
+                        help="四次挥手后继续等待的秒数, 以便重发服务器没收到的最后ACK")
+    args = parser.parse_args()
+    if args.total_packets <= 0 or args.window <= 0:
+        parser.error("数据包总数和窗口大小必须是正整数!")
+    if args.linger < 0:
+        parser.error("linger 不能小于0!")
+    if not 0 < args.mss <= MAX_PAYLOAD:
+        parser.error(f"mss 必须在 1~{MAX_PAYLOAD} 之间!")
+    if args.file is not None and not os.path.isfile(args.file):
+        parser.error(f"文件 {args.file} 不存在!")
+    return args
+
 
 if __name__ == "__main__":
-    if len(sys.argv) < 3:
-        print("用法: python udpclient.py  <服务器地址> <端口> [数据包总数] ")
-        print("示例: python udpclient.py 127.0.0.1 8888 40")
-        sys.exit(1)
-    server_ip = sys.argv[1]
-
-    server_port = int(sys.argv[2])
-    total_packets = int(sys.argv[3])
-    # server_ip = '127.0.0.1'
-    # server_port = 6666
-    # total_packets = 30
-    client = GBNClient(server_ip, server_port, total_packets)
-    client.run()
\ No newline at end of file
+    # 用法: python udpclient.py <服务器地址> <端口> [数据包总数] [--mode gbn|sr] [--cc fixed|reno|cubic] [--file 文件]
+    # 示例: python udpclient.py 127.0.0.1 8888 40 --mode sr
+    args = parse_args()
+    client = GBNClient(args.server_ip, args.server_port, args.total_packets, args.window, MODE_NAMES[args.mode],
+                       args.cc, args.file, args.mss, not args.no_batch, args.linger, seed=args.seed)
+    client.run()
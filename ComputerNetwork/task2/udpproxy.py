@@ -0,0 +1,258 @@
+import argparse
+import asyncio
+import collections
+import random
+import time
+
+# 网络损伤代理: 放在客户端和服务器之间, 对两个方向的数据报分别模拟 延迟、抖动、带宽、乱序、重复、突发丢包 和 损坏
+#   客户端 --> [代理 listen_port] --上行链路--> 服务器
+#   客户端 <--下行链路-- [代理] <-- 服务器
+# 每个客户端地址在代理上对应一个单独的上游 socket, 服务器看到的是不同的源端口, 多个客户端可以同时通过代理
+# 丢包用 Gilbert-Elliott 模型: 链路在 好/坏 两个状态之间按马尔可夫链切换, 好状态丢包率 loss, 坏状态丢包率 burst_loss,
+# 每个包之前以概率 burst_p 从好变坏, 以概率 burst_r 从坏变好, 平均突发长度 1/burst_r 个包; burst_p 为 0 时就是独立随机丢包
+# 两个方向各用一个由 seed 派生的随机数生成器, 相同的 seed 和相同的包序列得到相同的丢包/损坏/重复/乱序决定
+
+IDLE_TIMEOUT = 60  # 客户端多久没有任何数据报就删除对应的上游 socket
+QUEUE_LIMIT = 1000  # 带宽受限时瓶颈队列最多排队的包数, 超过就尾部丢弃
+
+
+class Link:
+    '''一个方向的链路: submit 对数据报做损伤后, 在计算好的时间调用 deliver(data) 发出'''
+
+    def __init__(self, name, loop, rng, delay=0.0, jitter=0.0, rate=0, loss=0.0, burst_p=0.0, burst_r=1.0,
+                 burst_loss=1.0, corrupt=0.0, duplicate=0.0, reorder=0.0, queue_limit=QUEUE_LIMIT):
+        self.name = name
+        self.loop = loop
+        self.rng = rng
+        self.delay = delay  # 单向传播延迟(秒)
+        self.jitter = jitter  # 延迟在 [delay - jitter, delay + jitter] 内均匀分布
+        self.rate = rate  # 带宽(字节/秒), 0 表示不限
+        self.loss = loss
+        self.burst_p = burst_p
+        self.burst_r = burst_r
+        self.burst_loss = burst_loss
+        self.corrupt = corrupt
+        self.duplicate = duplicate
+        self.reorder = reorder  # 以该概率不经过传播延迟直接发出, 越过前面还在路上的包
+        self.queue_limit = queue_limit
+
+        self.bad_state = False
+        self.tx_free_at = 0.0  # 瓶颈链路空闲的时间(loop.time())
+        self.last_arrival = 0.0  # 没有被乱序的包按先进先出到达, 抖动不会让它们互相超越
+        self.backlog = collections.deque()  # 瓶颈队列中各个包发完的时间
+        self.stats = dict.fromkeys(('received', 'delivered', 'lost', 'queue_drops', 'corrupted', 'duplicated',
+                                    'reordered'), 0)
+
+    def lose(self):
+        '''Gilbert-Elliott: 先转移状态, 再按当前状态的丢包率决定是否丢弃'''
+        if self.bad_state:
+            if self.rng.random() < self.burst_r:
+                self.bad_state = False
+        elif self.burst_p and self.rng.random() < self.burst_p:
+            self.bad_state = True
+        rate = self.burst_loss if self.bad_state else self.loss
+        return rate > 0 and self.rng.random() < rate
+
+    def damage(self, data):
+        '''随机翻转一个比特'''
+        data = bytearray(data)
+        if data:
+            data[self.rng.randrange(len(data))] ^= 1 << self.rng.randrange(8)
+        return bytes(data)
+
+    def submit(self, data, deliver):
+        self.stats['received'] += 1
+        if self.lose():
+            self.stats['lost'] += 1
+            return
+        copies = 1
+        if self.duplicate and self.rng.random() < self.duplicate:
+            copies = 2
+            self.stats['duplicated'] += 1
+        for _ in range(copies):
+            packet = data
+            if self.corrupt and self.rng.random() < self.corrupt:
+                packet = self.damage(data)
+                self.stats['corrupted'] += 1
+            self.schedule(packet, deliver)
+
+    def schedule(self, data, deliver):
+        now = self.loop.time()
+        sent_at = now
+        if self.rate:
+            backlog = self.backlog
+            while backlog and backlog[0] <= now:
+                backlog.popleft()
+            if len(backlog) >= self.queue_limit:
+                self.stats['queue_drops'] += 1
+                return
+            # 排在瓶颈队列里, 前面的包发完才轮到它
+            sent_at = max(now, self.tx_free_at) + len(data) / self.rate
+            self.tx_free_at = sent_at
+            backlog.append(sent_at)
+        if self.reorder and self.rng.random() < self.reorder:
+            arrival = sent_at
+            self.stats['reordered'] += 1
+        else:
+            latency = self.delay
+            if self.jitter:
+                latency += self.rng.uniform(-self.jitter, self.jitter)
+            arrival = max(sent_at + max(0.0, latency), self.last_arrival)
+            self.last_arrival = arrival
+        self.loop.call_at(arrival, self.arrive, data, deliver)
+
+    def arrive(self, data, deliver):
+        self.stats['delivered'] += 1
+        deliver(data)
+
+    def summary(self):
+        s = self.stats
+        return (f"{self.name}: 收到 {s['received']}, 发出 {s['delivered']}, 丢弃 {s['lost']}, 队列溢出 {s['queue_drops']}, "
+                f"损坏 {s['corrupted']}, 重复 {s['duplicated']}, 乱序 {s['reordered']}")
+
+
+class UpstreamProtocol(asyncio.DatagramProtocol):
+    '''代理上某个客户端对应的上游 socket, 收到服务器的数据报后经下行链路发回该客户端'''
+
+    def __init__(self, proxy, client_addr):
+        self.proxy = proxy
+        self.client_addr = client_addr
+        self.transport = None
+        self.pending = []  # 上游 socket 建好之前到达的数据报
+        self.last_active = time.time()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        for data in self.pending:
+            transport.sendto(data)
+        self.pending = None
+
+    def send(self, data):
+        self.last_active = time.time()
+        if self.transport is None:
+            self.pending.append(data)
+        elif not self.transport.is_closing():
+            self.transport.sendto(data)
+
+    def datagram_received(self, data, addr):
+        self.last_active = time.time()
+        self.proxy.downlink.submit(data, self.reply)
+
+    def reply(self, data):
+        self.proxy.transport.sendto(data, self.client_addr)
+
+    def error_received(self, exc):
+        pass  # 服务器还没启动等情况, 与真实网络一样静默丢弃
+
+
+class ImpairmentProxy(asyncio.DatagramProtocol):
+    '''监听 listen_port, 把客户端的数据报经上行链路转发给 server_addr'''
+
+    def __init__(self, server_addr, uplink, downlink, idle_timeout=IDLE_TIMEOUT):
+        self.server_addr = server_addr
+        self.uplink = uplink
+        self.downlink = downlink
+        self.idle_timeout = idle_timeout
+        self.upstreams = {}  # 客户端地址 -> UpstreamProtocol
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        upstream = self.upstreams.get(addr)
+        if upstream is None:
+            upstream = self.upstreams[addr] = UpstreamProtocol(self, addr)
+            loop = asyncio.get_running_loop()
+            loop.create_task(loop.create_datagram_endpoint(lambda: upstream, remote_addr=self.server_addr))
+            print(f"[{time.strftime('%H:%M:%S')}] 新客户端 {addr}, 当前客户端数: {len(self.upstreams)}")
+        upstream.last_active = time.time()
+        self.uplink.submit(data, upstream.send)
+
+    def error_received(self, exc):
+        pass
+
+    def expire_idle(self):
+        now = time.time()
+        for addr, upstream in list(self.upstreams.items()):
+            if now - upstream.last_active > self.idle_timeout:
+                if upstream.transport is not None:
+                    upstream.transport.close()
+                del self.upstreams[addr]
+                print(f"[{time.strftime('%H:%M:%S')}] 客户端 {addr} 空闲超时, 当前客户端数: {len(self.upstreams)}")
+
+
+def link_params(args):
+    return dict(delay=args.delay / 1000, jitter=args.jitter / 1000, rate=args.rate * 1000 / 8, loss=args.loss,
+                burst_p=args.burst_p, burst_r=args.burst_r, burst_loss=args.burst_loss, corrupt=args.corrupt,
+                duplicate=args.duplicate, reorder=args.reorder, queue_limit=args.queue)
+
+
+async def serve(args):
+    loop = asyncio.get_running_loop()
+    params = link_params(args)
+    # 只损伤一个方向时, 另一个方向直接转发
+    uplink = Link('上行(客户端->服务器)', loop, random.Random(args.seed), **(params if args.direction != 'down' else {}))
+    downlink = Link('下行(服务器->客户端)', loop, random.Random(args.seed + 1),
+                    **(params if args.direction != 'up' else {}))
+    server_addr = (args.server_host, args.server_port)
+    proxy = ImpairmentProxy(server_addr, uplink, downlink, args.idle_timeout)
+    transport, _ = await loop.create_datagram_endpoint(lambda: proxy, local_addr=(args.host, args.listen_port))
+    print(f"UDP 损伤代理启动, {args.host}:{args.listen_port} -> {server_addr[0]}:{server_addr[1]}, 损伤方向: {args.direction}")
+    print(f"延迟 {args.delay}ms ±{args.jitter}ms, 带宽 {args.rate or '不限'}{'kbit/s' if args.rate else ''}, "
+          f"丢包 {args.loss} (突发 p={args.burst_p} r={args.burst_r} 坏状态丢包 {args.burst_loss}), 损坏 {args.corrupt}, "
+          f"重复 {args.duplicate}, 乱序 {args.reorder}, seed={args.seed}")
+    try:
+        while True:
+            await asyncio.sleep(1)
+            proxy.expire_idle()
+    finally:
+        transport.close()
+        for upstream in proxy.upstreams.values():
+            if upstream.transport is not None:
+                upstream.transport.close()
+        print(uplink.summary())
+        print(downlink.summary())
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='udpproxy.py', description="UDP 网络损伤代理, 在本机模拟广域网链路")
+    parser.add_argument('listen_port', type=int, help="代理监听的端口, 客户端连这个端口")
+    parser.add_argument('server_port', type=int, help="服务器端口")
+    parser.add_argument('--server-host', default='127.0.0.1', help="服务器地址")
+    parser.add_argument('--host', default='0.0.0.0', help="代理监听的地址")
+    parser.add_argument('--delay', type=float, default=0.0, help="单向延迟(毫秒)")
+    parser.add_argument('--jitter', type=float, default=0.0, help="延迟抖动(毫秒), 在 delay±jitter 内均匀分布")
+    parser.add_argument('--rate', type=float, default=0, help="每个方向的带宽(kbit/s), 0 表示不限")
+    parser.add_argument('--queue', type=int, default=QUEUE_LIMIT, help="带宽受限时的队列长度(包数)")
+    parser.add_argument('--loss', type=float, default=0.0, help="丢包率(Gilbert-Elliott 好状态下的丢包率)")
+    parser.add_argument('--burst-p', type=float, default=0.0, help="每个包之前从好状态进入坏状态的概率, 0 表示不产生突发丢包")
+    parser.add_argument('--burst-r', type=float, default=0.5, help="每个包之前从坏状态回到好状态的概率")
+    parser.add_argument('--burst-loss', type=float, default=1.0, help="坏状态下的丢包率")
+    parser.add_argument('--corrupt', type=float, default=0.0, help="数据报被翻转一个比特的概率")
+    parser.add_argument('--duplicate', type=float, default=0.0, help="数据报被复制一份的概率")
+    parser.add_argument('--reorder', type=float, default=0.0, help="数据报不经过延迟直接发出(越过前面的包)的概率")
+    parser.add_argument('--direction', choices=['both', 'up', 'down'], default='both',
+                        help="损伤哪个方向: up 客户端到服务器, down 服务器到客户端")
+    parser.add_argument('--seed', type=int, default=1, help="随机数种子")
+    parser.add_argument('--idle-timeout', type=float, default=IDLE_TIMEOUT, help="客户端空闲多久后释放上游 socket(秒)")
+    return parser
+
+
+def parse_args(parser=None):
+    parser = parser or build_parser()
+    args = parser.parse_args()
+    probabilities = (args.loss, args.burst_p, args.burst_r, args.burst_loss, args.corrupt, args.duplicate, args.reorder)
+    if not all(0 <= p <= 1 for p in probabilities):
+        parser.error("各概率参数必须在0~1之间!")
+    if args.delay < 0 or args.jitter < 0 or args.rate < 0 or args.queue <= 0:
+        parser.error("delay、jitter、rate 不能小于0, queue 必须是正整数!")
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        print("\n代理关闭中...")
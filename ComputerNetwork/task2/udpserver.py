@@ -1,59 +1,47 @@
 
+import argparse
+import os
 import time
 import threading
 import random
-import struct
 import socket
 import queue
-import sys
-# 标志位
-mySYN = 0x8000
-myACK = 0x4000
-myFIN = 0x2000
-myDATA = 0x1000
-
-HEADER_FORMAT = '!III H'
-HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
-
-def crc_checksum(data: bytes, poly=0x1021, init=0xFFFF) -> int: #crc冗余校验
-    crc = init
-    for byte in data:
-        crc ^= byte << 8
-        for _ in range(8):
-            if (crc & 0x8000):
-                crc = (crc << 1) ^ poly
-            else:
-                crc <<= 1
-            crc &= 0xFFFF
-    return crc & 0x0FFF
-
-def create_packet(seq, ack, pkt_num, flags, payload=b''): #创建数据包
-    header_without_checksum = struct.pack(HEADER_FORMAT, seq, ack, pkt_num, flags)
-    checksum = crc_checksum(header_without_checksum + payload)
-    flags_with_checksum = flags | checksum
-    packet = struct.pack(HEADER_FORMAT, seq, ack, pkt_num, flags_with_checksum) + payload
-    return packet
-
-def unpack_header(header): #解封装头部
-    seq, ack, pkt_num, flags_with_checksum = struct.unpack(HEADER_FORMAT, header)
-    flags = flags_with_checksum & 0xF000
-    checksum = flags_with_checksum & 0x0FFF
-    return seq, ack, pkt_num, flags, checksum
-
-def verify_checksum(data):
-    if len(data) < HEADER_SIZE:
-        return False
-    seq, ack, pkt_num, flags_with_checksum = struct.unpack(HEADER_FORMAT, data[:HEADER_SIZE])
-    recv_flags = flags_with_checksum & 0xF000
-    recv_checksum = flags_with_checksum & 0x0FFF
-    header_without_checksum = struct.pack(HEADER_FORMAT, seq, ack, pkt_num, recv_flags)
-    cal_checksum = crc_checksum(header_without_checksum + data[HEADER_SIZE:])
-    return cal_checksum == recv_checksum
-
-class ClientHandler(threading.Thread):
-    def __init__(self, sock, client_addr, loss_rate=0.2, corruption_rate=0.05):
-        super().__init__()
+from batchio import BatchReceiver
+from packet import (FLAGS_OFFSET, HEADER_SIZE, MAX_SACK_BLOCKS, MODE_SR, SACK_BLOCK, SYN_OPTION, BufferPool,
+                    PacketBuilder, create_packet, myACK, myDATA, myFIN, mySYN, pack_sack, parse_filename, parse_mode,
+                    unpack_header, verify_checksum) #header格式和组包/校验见 packet.py
+from timerwheel import TimerWheel
+
+
+def output_filename(client_addr, filename=None):
+    '''输出文件名: 客户端在 SYN 中给了文件名就用它(只取最后一段, 不允许写到输出目录之外), 否则用客户端地址'''
+    if filename:
+        filename = os.path.basename(filename.replace('\\', '/'))
+    if not filename or filename in ('.', '..'):
+        filename = f"{client_addr[0]}_{client_addr[1]}.bin"
+    return filename
+
+
+FIN_RETRY_INTERVAL = 0.3  # 等待最后ACK时重发FIN的间隔(秒)
+IDLE_TIMEOUT = 60.0  # 连接超过这么久没有收到任何包就回收
+TIME_WAIT = 5.0  # 连接关闭后在连接表中保留这么久, 期间同一地址除 SYN 以外的迟到包直接丢弃
+FIN_TIMER = object()  # 时间轮通过连接的队列通知 FIN 重发定时器到期
+ACK_TIMER = object()  # 延迟ACK定时器到期
+ACK_DELAY = 0.04  # 延迟ACK最多等待的时间(秒), 线程版按时间轮的 tick 向上取整
+ACK_PACKET_SIZE = HEADER_SIZE + SACK_BLOCK.size * MAX_SACK_BLOCKS  # 服务器发出的最大的包, 每个连接的组包缓冲区只需要这么大
+
+
+class Connection:
+    '''一个客户端连接的协议状态机: 握手、收数据、挥手都在 process_packet 中处理, 不涉及线程
+
+    sock 只需要提供 sendto(data, addr), 线程版传 socket, asyncio 版传 DatagramTransport;
+    builder 用来组 ACK, 同一线程中的多个连接可以共用一个
+    '''
+
+    def __init__(self, sock, client_addr, loss_rate=0.2, corruption_rate=0.05, output_dir=None, builder=None,
+                 ack_every=1, ack_delay=ACK_DELAY):
         self.sock = sock
+        self.builder = builder or PacketBuilder(ACK_PACKET_SIZE)  # ACK 在复用的缓冲区里组装
         self.client_addr = client_addr
         self.loss_rate = loss_rate
         self.corruption_rate = corruption_rate
@@ -61,9 +49,26 @@ class ClientHandler(threading.Thread):
         self.conn_established = False
         self.expected_seq = 0
         self.total_packets = 0
+        self.selective = False  # 握手时协商: True 为选择重传, False 为 GBN
+        self.out_of_order = {}  # 选择重传时缓存的乱序包: 起始字节 -> 长度
+        self.recv_window = 64 * 1024  # 最多缓存到 expected_seq 之后这么多字节
         self.server_isn = random.randint(0, 0xffffffff)
 
-        self.queue = queue.Queue()
+        # 延迟ACK: 每收到 ack_every 个按序的包才回一个累计ACK, 不足时最多等 ack_delay 秒; 乱序、重复、补上空缺的包立即ACK
+        # ack_every 为 1 时和原来一样每个包都ACK
+        self.ack_every = ack_every
+        self.ack_delay = ack_delay
+        self.pending_acks = 0  # 已经按序收到但还没有ACK的包数
+        self.ack_pending_since = 0.0
+        self.acks_sent = 0
+
+        # 指定了输出目录时, 收到的数据按序列号(即文件偏移)直接写进输出文件, 乱序到达的包也立即写到对应位置
+        self.output_dir = output_dir
+        self.filename = None  # SYN 中带来的文件名
+        self.output_path = None
+        self.output_fd = None
+        self.bytes_written = 0
+
         self.active = True
 
         # 以下用于挥手时的状态管理
@@ -75,47 +80,28 @@ class ClientHandler(threading.Thread):
 
         print(f"新的连接来自 {client_addr}, 丢包率模拟: {loss_rate * 100}%")
 
-    def run(self):
-        while self.active:
-            try:
-                data = self.queue.get(timeout=0.1)
-                self.process_packet(data)
-            except queue.Empty:
-                # 定时检测最后挥手的ACK,超时重发FIN 这里最多重发5次 因为可能客户端已经关闭了再发也没用
-                if self.waiting_for_last_ack:
-                    now = time.time()
-                    if now - self.last_fin_sent_time > 0.3:
-                        if self.fin_retry_count < self.max_fin_retries:
-                            self.sock.sendto(self.fin_packet, self.client_addr)
-                            print(f"[{time.strftime('%H:%M:%S')}] 超时未收到最后ACK，重发 FIN 第{self.fin_retry_count + 1}次")
-                            self.fin_retry_count += 1
-                            self.last_fin_sent_time = now
-                        else:
-                            print(f"[{time.strftime('%H:%M:%S')}] 重发 FIN 超过最大次数，关闭连接")
-                            self.active = False
-
-        print(f"与{self.client_addr}的连接已关闭")
-
     def process_packet(self, data): #处理数据包
+        '''处理一个数据包, data 是 memoryview; 处理完后 active 为 False 表示连接已关闭'''
         if len(data) < HEADER_SIZE:
             return
 
-        header = data[:HEADER_SIZE]
-        payload = data[HEADER_SIZE:]
-        data_len = len(payload)
-        current_time = time.strftime("%H:%M:%S")
-
         # 模拟包损坏
         if random.random() < self.corruption_rate:
+            if data.readonly:  # asyncio 收到的是 bytes, 只有要损坏时才拷贝一份
+                data = memoryview(bytearray(data))
             pos = random.randint(0, len(data) - 1)
-            data = data[:pos] + bytes([data[pos] ^ 0xFF]) + data[pos + 1:]
+            data[pos] ^= 0xFF  # 线程版的缓冲区是自己的, 直接原地修改
             print(f"模拟包损坏: 修改了位置 {pos} 的字节")
 
+        header = data[:HEADER_SIZE]
+        payload = data[HEADER_SIZE:]
+        data_len = len(payload)
+        current_time = time.strftime("%H:%M:%S")
+
         #损坏就check_sum出错了
         if not verify_checksum(data):
             print(f"Error: [{current_time}] 校验和失败! 数据包来自{self.client_addr}!")
-            header = create_packet(0, self.expected_seq, 0, myACK)
-            self.sock.sendto(header, self.client_addr)
+            self.send_ack()
             print(f"[{current_time}] 发送重复 ACK 到 {self.client_addr}, ack={self.expected_seq}")
             return
 
@@ -124,43 +110,73 @@ class ClientHandler(threading.Thread):
         #第一次握手
         if flags & mySYN and not self.conn_established:
             print(f"[{current_time}] 收到 {self.client_addr} 的 SYN, seq = {seq}")
-            header = create_packet(self.server_isn, seq + 1, 0, mySYN | myACK)
-            self.sock.sendto(header, self.client_addr)
-            print(f"[{current_time}] 发送 SYN-ACK 到 {self.client_addr}, seq = {self.server_isn}, ack = {seq + 1}")
+            # SYN 带了模式就回复同意的模式, 不带的是旧客户端, 回复的 SYN-ACK 也不带数据
+            options = b''
+            if payload:
+                self.selective = parse_mode(payload) == MODE_SR
+                self.filename = parse_filename(payload)
+                options = SYN_OPTION.pack(MODE_SR if self.selective else 0)
+            self.send(self.server_isn, seq + 1, 0, mySYN | myACK, options)
+            print(f"[{current_time}] 发送 SYN-ACK 到 {self.client_addr}, seq = {self.server_isn}, ack = {seq + 1}, "
+                  f"模式: {'SR' if self.selective else 'GBN'}")
 
         #第三次握手
         elif flags & myACK and not self.conn_established and ack == self.server_isn + 1:
             self.conn_established = True
             self.expected_seq = 0
             print(f"[{current_time}] 和 {self.client_addr} 三次握手完成，连接已建立！")
+            if self.output_dir is not None:
+                self.open_output()
 
         #处理数据
         elif flags & myDATA and self.conn_established:
             if random.random() < self.loss_rate:
                 print(f"Error: [{current_time}] 接受{self.client_addr}数据时发生丢包 (seq = {seq})")
                 return
-            #必须顺序否则重传
+            #GBN必须顺序否则重传; 选择重传时窗口内的乱序包先缓存, 用SACK告诉客户端
             if seq == self.expected_seq:
+                self.write_data(seq, payload)
                 self.expected_seq += data_len
                 self.total_packets += 1
                 start_byte = seq
                 end_byte = seq + data_len - 1
                 print(f"[{current_time}] 收到来自 {self.client_addr} 的数据包 {pkt_num} ({start_byte}~{end_byte}字节)")
 
-                header = create_packet(0, self.expected_seq, 0, myACK)
-                self.sock.sendto(header, self.client_addr)
-                print(f"[{current_time}] 发送 ACK 到 {self.client_addr}, ack={self.expected_seq}")
+                # 补上空缺后, 之前缓存的连续乱序包一起确认
+                filled_gap = bool(self.out_of_order)
+                while self.expected_seq in self.out_of_order:
+                    self.expected_seq += self.out_of_order.pop(self.expected_seq)
+
+                self.pending_acks += 1
+                if filled_gap or self.pending_acks >= self.ack_every:
+                    self.send_ack()
+                    print(f"[{current_time}] 发送 ACK 到 {self.client_addr}, ack={self.expected_seq}")
+                elif self.pending_acks == 1:
+                    self.ack_pending_since = time.time()
+                    self.start_ack_timer()
+
+            elif self.selective and self.expected_seq < seq < self.expected_seq + self.recv_window:
+                if seq not in self.out_of_order:
+                    self.write_data(seq, payload)
+                    self.out_of_order[seq] = data_len
+                    self.total_packets += 1
+                    print(f"[{current_time}] 缓存来自 {self.client_addr} 的乱序数据包 {pkt_num} "
+                          f"({seq}~{seq + data_len - 1}字节)")
+                self.send_ack(seq)
+                print(f"[{current_time}] 发送 SACK 到 {self.client_addr}, ack={self.expected_seq}")
 
             else:
-                header = create_packet(0, self.expected_seq, 0, myACK)
-                self.sock.sendto(header, self.client_addr)
+                self.send_ack()
                 print(f"[{current_time}] 发送重复 ACK 到 {self.client_addr}, ack={self.expected_seq}")
 
         elif flags & myFIN:
             print(f"[{current_time}] 收到 {self.client_addr} 的 FIN")
+            self.close_output()  # FIN 之前的数据都已按序收到, 文件已经完整
+            if self.pending_acks:  # 对 FIN 的 ACK 同时确认了延迟中的数据
+                self.pending_acks = 0
+                self.cancel_ack_timer()
             # 发送ACK确认第二次挥手
-            header = create_packet(0, seq + 1, 0, myACK)
-            self.sock.sendto(header, self.client_addr)
+            self.send(0, seq + 1, 0, myACK)
             print(f"[{current_time}] 发送 ACK 到 {self.client_addr}, ack={seq + 1}")
 
             # 发送 FIN，开始等待最后ACK
@@ -171,6 +187,7 @@ class ClientHandler(threading.Thread):
             self.last_fin_sent_time = time.time()
             self.fin_retry_count = 0
             self.waiting_for_last_ack = True
+            self.start_fin_timer()
 
         elif flags & myACK and self.waiting_for_last_ack:
             # 判断是否是最后ACK，确认ACK号等于FIN序号+1（这里FIN序号是0，所以ACK==1）
@@ -182,36 +199,220 @@ class ClientHandler(threading.Thread):
                 self.active = False
 
 
-    def add_packet(self, data):
-        self.queue.put(data)
+    def start_fin_timer(self):
+        '''发出 FIN 后调用; 线程版在收包循环里轮询 last_fin_sent_time, 不需要定时器, asyncio 版在这里注册回调'''
+
+    def retry_fin(self):
+        '''等待最后ACK超时: 重发FIN, 这里最多重发5次 因为可能客户端已经关闭了再发也没用; 返回是否还要继续等待'''
+        if self.fin_retry_count < self.max_fin_retries:
+            self.sock.sendto(self.fin_packet, self.client_addr)
+            print(f"[{time.strftime('%H:%M:%S')}] 超时未收到最后ACK，重发 FIN 第{self.fin_retry_count + 1}次")
+            self.fin_retry_count += 1
+            self.last_fin_sent_time = time.time()
+            return True
+        print(f"[{time.strftime('%H:%M:%S')}] 重发 FIN 超过最大次数，关闭连接")
+        self.active = False
+        return False
+
+    def open_output(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.output_path = os.path.join(self.output_dir, output_filename(self.client_addr, self.filename))
+        flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0)  # Windows 需要 O_BINARY
+        self.output_fd = os.open(self.output_path, flags, 0o644)
+        self.bytes_written = 0
+        print(f"[{time.strftime('%H:%M:%S')}] {self.client_addr} 的数据将写入 {self.output_path}")
+
+    def write_data(self, offset, payload):
+        '''把数据写到输出文件的 offset 处; payload 是收包缓冲区的 memoryview, 直接写出不拷贝'''
+        if self.output_fd is None:
+            return
+        if hasattr(os, 'pwrite'):
+            os.pwrite(self.output_fd, payload, offset)
+        else:  # Windows 没有 pwrite
+            os.lseek(self.output_fd, offset, os.SEEK_SET)
+            os.write(self.output_fd, payload)
+        self.bytes_written += len(payload)
+
+    def close_output(self):
+        if self.output_fd is None:
+            return
+        os.close(self.output_fd)
+        self.output_fd = None
+        print(f"[{time.strftime('%H:%M:%S')}] 已保存 {self.output_path}, 共 {self.expected_seq} 字节")
+
+    def send(self, seq, ack, pkt_num, flags, payload=b''):
+        '''组一个控制包(ACK等)并发送'''
+        self.sock.sendto(self.builder.build(seq, ack, pkt_num, flags, payload), self.client_addr)
+
+    def send_ack(self, recent=None):
+        '''发送累计确认 ack=expected_seq; 选择重传且有缓存的乱序包时, 数据部分带上SACK块; 同时确认了所有延迟中的包'''
+        payload = b''
+        if self.selective and self.out_of_order:
+            payload = pack_sack(self.sack_blocks(recent))
+        self.send(0, self.expected_seq, 0, myACK, payload)
+        self.acks_sent += 1
+        if self.pending_acks:
+            self.pending_acks = 0
+            self.cancel_ack_timer()
+
+    def start_ack_timer(self):
+        '''有包等待延迟ACK时调用, 各版本用自己的定时器在 ack_delay 秒后调用 on_ack_timer'''
+
+    def cancel_ack_timer(self):
+        '''延迟中的包已经随其他ACK确认'''
+
+    def on_ack_timer(self):
+        if self.pending_acks and self.active:
+            self.send_ack()
+            print(f"[{time.strftime('%H:%M:%S')}] 延迟ACK到期, 发送 ACK 到 {self.client_addr}, ack={self.expected_seq}")
+
+    def sack_blocks(self, recent=None):
+        '''把缓存的乱序包合并成连续的 [start, end) 块; 和TCP一样, 包含最近收到的包的块放在最前面'''
+        blocks = []
+        for start in sorted(self.out_of_order):
+            end = start + self.out_of_order[start]
+            if blocks and blocks[-1][1] == start:
+                blocks[-1][1] = end
+            else:
+                blocks.append([start, end])
+        for i, (start, end) in enumerate(blocks):
+            if recent is not None and start <= recent < end:
+                blocks.insert(0, blocks.pop(i))
+                break
+        return blocks
 
     def close(self):
         self.active = False
 
 
+class ClientHandler(Connection, threading.Thread):
+    '''线程版: 每个客户端一个线程, 收包线程通过队列把数据包交给它
+
+    有时间轮时 FIN 重发和延迟ACK由时间轮定时, 到期时往队列里放 FIN_TIMER/ACK_TIMER, 线程空闲时一直阻塞在队列上;
+    没有时间轮时和原来一样每 100ms 醒来检查一次. 线程结束时调用 on_close(self)
+    '''
+
+    def __init__(self, sock, client_addr, loss_rate=0.2, corruption_rate=0.05, pool=None, output_dir=None,
+                 wheel=None, on_close=None, ack_every=1, ack_delay=ACK_DELAY):
+        threading.Thread.__init__(self)
+        Connection.__init__(self, sock, client_addr, loss_rate, corruption_rate, output_dir, ack_every=ack_every,
+                            ack_delay=ack_delay)
+        self.pool = pool  # 收包缓冲区处理完后还给这个池
+        self.queue = queue.Queue()
+        self.wheel = wheel
+        self.on_close = on_close
+        self.fin_timer = None
+        self.ack_timer = None
+        self.idle_timer = None
+        self.last_active = time.monotonic()  # 收包线程每次交给它数据包时更新
+
+    def run(self):
+        while self.active:
+            try:
+                item = self.queue.get(timeout=None if self.wheel else 0.1)
+            except queue.Empty:
+                # 定时检测最后挥手的ACK,超时重发FIN
+                if self.waiting_for_last_ack and time.time() - self.last_fin_sent_time > FIN_RETRY_INTERVAL:
+                    self.retry_fin()
+                if self.pending_acks and time.time() - self.ack_pending_since >= self.ack_delay:
+                    self.on_ack_timer()
+                continue
+            if item is None:  # close() 唤醒线程退出
+                break
+            if item is FIN_TIMER:
+                if self.waiting_for_last_ack and self.retry_fin():
+                    self.start_fin_timer()
+                continue
+            if item is ACK_TIMER:
+                self.ack_timer = None
+                self.on_ack_timer()
+                continue
+            buffer, n = item
+            try:
+                self.process_packet(memoryview(buffer)[:n])
+            finally:
+                if self.pool is not None:
+                    self.pool.release(buffer)
+
+        if self.fin_timer is not None:
+            self.fin_timer.cancel()
+        self.cancel_ack_timer()
+        self.close_output()
+        print(f"与{self.client_addr}的连接已关闭, 收到 {self.total_packets} 个数据包, 发送 {self.acks_sent} 个 ACK")
+        if self.on_close is not None:
+            self.on_close(self)
+
+    def start_fin_timer(self):
+        if self.wheel is None:
+            return
+        if self.fin_timer is not None:  # 重复的FIN会重新开始计时
+            self.fin_timer.cancel()
+        self.fin_timer = self.wheel.schedule(FIN_RETRY_INTERVAL, self.queue.put, FIN_TIMER)
+
+    def start_ack_timer(self):
+        if self.wheel is not None:
+            self.ack_timer = self.wheel.schedule(self.ack_delay, self.queue.put, ACK_TIMER)
+
+    def cancel_ack_timer(self):
+        if self.ack_timer is not None:
+            self.ack_timer.cancel()
+            self.ack_timer = None
+
+    def add_packet(self, buffer, n):
+        '''buffer 的前 n 个字节是收到的数据包'''
+        self.queue.put((buffer, n))
+
+    def close(self):
+        super().close()
+        self.queue.put(None)
+
+
 class UDPServer:
-    def __init__(self, port, loss_rate=0.2,corruption_rate = 0.05):
+    def __init__(self, port, loss_rate=0.2,corruption_rate = 0.05, output_dir=None, batch_io=True, reuse_port=False,
+                 idle_timeout=IDLE_TIMEOUT, time_wait=TIME_WAIT, ack_every=1, ack_delay=ACK_DELAY):
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            # 多个进程各自绑定同一端口, 内核按 (源地址, 源端口, 目的地址, 目的端口) 的哈希把数据报分给其中一个 socket
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.sock.bind(('', port))
 
         self.loss_rate = loss_rate
+        # 连接表: 活动的连接 地址 -> ClientHandler; 关闭后的地址在 time_wait 中保留一段时间, 地址 -> 到期定时器
+        # 连接表只在收包线程中修改, 连接线程结束、空闲超时、TIME_WAIT 到期都通过时间轮回到收包线程处理
         self.client_handlers = {}
+        self.time_wait = {}
+        self.idle_timeout = idle_timeout
+        self.time_wait_seconds = time_wait
+        self.wheel = TimerWheel()
+        self.evicted = 0
+        self.ack_every = ack_every
+        self.ack_delay = ack_delay
         self.port = port
         self.corruption_rate = corruption_rate
-        print(f"UDP 服务器启动, 端口: {port}, 丢包率: {loss_rate * 100}%")
+        self.pool = BufferPool()  # 收包缓冲区池, 收包不再每次分配 bytes
+        self.output_dir = output_dir
+        # 批量接收: 一次 recvmmsg 收下所有已到达的数据报, 再拷进池中的缓冲区分给各个连接; 不支持时和原来一样逐个 recvfrom_into
+        self.receiver = BatchReceiver(self.sock, batched=None if batch_io else False)
+        print(f"UDP 服务器启动, 端口: {port}, 丢包率: {loss_rate * 100}%, "
+              f"收包方式: {'批量(recvmmsg)' if self.receiver.batched else '逐包(recvfrom_into)'}")
+        if output_dir is not None:
+            print(f"收到的数据保存到 {output_dir}")
 
     def run(self):
         print(f"服务器监听在{self.port}端口,等待连接....")
+        self.sock.settimeout(self.wheel.tick)  # 没有数据时也按 tick 醒来推进时间轮
         try:
             while True:
-                data, address = self.sock.recvfrom(2048)
-                if address not in self.client_handlers:
-                    handler = ClientHandler(self.sock, address, self.loss_rate,self.corruption_rate)
-                    handler.daemon = True
-                    handler.start()
-                    self.client_handlers[address] = handler
-                self.client_handlers[address].add_packet(data)
+                try:
+                    packets = self.receive()
+                except socket.timeout:
+                    packets = ()
+                if packets:
+                    now = time.monotonic()
+                    for buffer, n, address in packets:
+                        self.dispatch(buffer, n, address, now)
+                self.wheel.advance()
         except KeyboardInterrupt:
             print("\n服务器关闭中...")
             for handler in self.client_handlers.values():
@@ -219,18 +420,118 @@ class UDPServer:
         finally:
             self.sock.close()
 
+    def dispatch(self, buffer, n, address, now):
+        '''把数据包交给地址对应的连接, 没有就新建; TIME_WAIT 中的地址只接受 SYN(客户端复用端口重新连接)'''
+        handler = self.client_handlers.get(address)
+        if handler is not None and not handler.active:  # 线程已经结束, 时间轮还没来得及处理
+            self.connection_closed(handler)
+            handler = None
+        if handler is None:
+            if address in self.time_wait:
+                if not buffer[FLAGS_OFFSET] & (mySYN >> 8) or not verify_checksum(memoryview(buffer)[:n]):
+                    self.pool.release(buffer)  # 旧连接的迟到包
+                    return
+                self.time_wait.pop(address).cancel()
+                print(f"{address} 在 TIME_WAIT 中重新连接")
+            handler = self.open_connection(address)
+        handler.last_active = now
+        handler.add_packet(buffer, n)
+
+    def open_connection(self, address):
+        handler = ClientHandler(self.sock, address, self.loss_rate,self.corruption_rate, self.pool,
+                                self.output_dir, self.wheel, self.on_handler_exit, self.ack_every, self.ack_delay)
+        handler.daemon = True
+        handler.start()
+        self.client_handlers[address] = handler
+        handler.idle_timer = self.wheel.schedule(self.idle_timeout, self.check_idle, handler)
+        return handler
+
+    def on_handler_exit(self, handler):
+        '''在连接线程中调用, 交给时间轮在收包线程中处理'''
+        self.wheel.schedule(0, self.connection_closed, handler)
+
+    def connection_closed(self, handler):
+        '''连接关闭: 移出连接表进入 TIME_WAIT; 同一个连接可能被通知多次, 只处理一次'''
+        if self.client_handlers.get(handler.client_addr) is not handler:
+            return
+        del self.client_handlers[handler.client_addr]
+        if handler.idle_timer is not None:
+            handler.idle_timer.cancel()
+        address = handler.client_addr
+        self.time_wait[address] = self.wheel.schedule(self.time_wait_seconds, self.time_wait_expired, address)
+        print(f"{address} 进入 TIME_WAIT, 当前连接数: {len(self.client_handlers)}, TIME_WAIT: {len(self.time_wait)}")
+
+    def time_wait_expired(self, address):
+        self.time_wait.pop(address, None)
+
+    def check_idle(self, handler):
+        '''空闲定时器到期: 期间收到过包就按最后收包时间重新定时, 否则关闭连接(线程退出后进入 TIME_WAIT)'''
+        if self.client_handlers.get(handler.client_addr) is not handler:
+            return
+        remaining = handler.last_active + self.idle_timeout - time.monotonic()
+        if remaining > 0:
+            handler.idle_timer = self.wheel.schedule(remaining, self.check_idle, handler)
+            return
+        self.evicted += 1
+        print(f"{handler.client_addr} 空闲超过 {self.idle_timeout:.0f} 秒, 回收连接 (累计回收 {self.evicted} 个)")
+        handler.close()
+        self.connection_closed(handler)
+
+    def receive(self):
+        '''收下已到达的数据报, 返回 [(缓冲区, 长度, 地址), ...], 缓冲区都来自 pool, 处理完由连接线程归还'''
+        if not self.receiver.batched:
+            buffer = self.pool.acquire()
+            try:
+                n, address = self.sock.recvfrom_into(buffer)
+            except socket.timeout:
+                self.pool.release(buffer)
+                raise
+            return [(buffer, n, address)]
+        packets = []
+        for data, address in self.receiver.recv():
+            buffer = self.pool.acquire()
+            n = len(data)
+            buffer[:n] = data  # 批量接收的缓冲区下次 recv 会被覆盖, 拷一份交给连接线程
+            packets.append((buffer, n, address))
+        return packets
+
+
+def build_parser(description="基于UDP的可靠传输服务器", prog='udpserver.py', thread_options=True):
+    '''服务器的公共命令行参数, asyncio 版和多进程版在此基础上增减'''
+    parser = argparse.ArgumentParser(description=description,
+                                     epilog=f"示例: python {prog} 6666 0.03 0.05 --output-dir received")
+    parser.add_argument('port', type=int, help="监听端口")
+    parser.add_argument('loss_rate', nargs='?', type=float, default=0.2, help="模拟丢包率")
+    parser.add_argument('corruption_rate', nargs='?', type=float, default=0.05, help="模拟数据损坏率")
+    parser.add_argument('--output-dir', help="把收到的数据按序列号写入该目录下的文件(文件名取自客户端, 没有则用客户端地址)")
+    parser.add_argument('--ack-every', type=int, default=1, help="每收到几个按序的数据包回一个ACK(延迟ACK), 默认每个都回")
+    parser.add_argument('--ack-delay', type=float, default=ACK_DELAY, help="延迟ACK最多等待的秒数")
+    if thread_options:  # 以下只对线程版有效
+        parser.add_argument('--no-batch', action='store_true', help="不使用 recvmmsg 批量收包, 每个包一次系统调用")
+        parser.add_argument('--idle-timeout', type=float, default=IDLE_TIMEOUT, help="连接空闲多少秒后回收")
+        parser.add_argument('--time-wait', type=float, default=TIME_WAIT,
+                            help="连接关闭后保留多少秒, 期间丢弃该地址除 SYN 以外的迟到包")
+    return parser
+
+
+def parse_args(parser=None):
+    parser = parser or build_parser()
+    args = parser.parse_args()
+    if not (0 <= args.loss_rate < 1 and 0 <= args.corruption_rate < 1):
+        parser.error("丢包率和数据损坏率必须在 0~1 之间!")
+    if args.ack_every <= 0 or args.ack_delay < 0:
+        parser.error("ack-every 必须是正整数, ack-delay 不能小于0!")
+    if getattr(args, 'idle_timeout', 1) <= 0 or getattr(args, 'time_wait', 0) < 0:
+        parser.error("idle-timeout 必须大于0, time-wait 不能小于0!")
+    return args
+
 
 if __name__ == "__main__":
-    if len(sys.argv) < 3:
-        print("用法: python udpserver.py <端口> [丢包率] [数据损坏率]")
-        print("示例: python udpserver.py 6666 0.03 0.05")
-        sys.exit(1)
-
-    port = int(sys.argv[1])
-    loss_rate = float(sys.argv[2]) if len(sys.argv) > 2 else 0.2
-    corruption_rate = float(sys.argv[3]) if len(sys.argv) > 3 else 0.05
+    args = parse_args()
     # port = 6666
     # loss_rate = 0.03
     # corruption_rate = 0.03
-    server = UDPServer(port, loss_rate,corruption_rate)
+    server = UDPServer(args.port, args.loss_rate, args.corruption_rate, args.output_dir, not args.no_batch,
+                       idle_timeout=args.idle_timeout, time_wait=args.time_wait, ack_every=args.ack_every,
+                       ack_delay=args.ack_delay)
     server.run()
\ No newline at end of file
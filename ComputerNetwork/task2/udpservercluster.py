@@ -0,0 +1,126 @@
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+from udpasyncserver import run_server
+from udpserver import ACK_DELAY, IDLE_TIMEOUT, TIME_WAIT, UDPServer, build_parser, parse_args
+
+# 多进程服务器: N 个工作进程用 SO_REUSEPORT 绑定同一端口, 每个进程运行原来的服务器(线程版或 asyncio 版)
+# Linux 对同一端口上的多个 UDP socket 按 (源地址, 源端口, 目的地址, 目的端口) 的哈希选择一个, 所以同一个客户端地址的数据报
+# 总是交给同一个工作进程, 连接状态只存在于这个进程中, 进程之间不需要共享任何东西
+# 注意: 工作进程退出或重启时 socket 的个数和顺序会变化, 正在进行的连接可能被分到别的进程, 需要客户端重新连接
+
+
+def worker_main(engine, port, loss_rate, corruption_rate, output_dir=None, batch_io=True, idle_timeout=IDLE_TIMEOUT,
+                time_wait=TIME_WAIT, ack_every=1, ack_delay=ACK_DELAY):
+    '''工作进程: 用 SO_REUSEPORT 绑定同一端口, 运行原有的服务器'''
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)  # 不继承监督进程的SIGTERM处理, 保证terminate能结束工作进程
+    print(f"工作进程{os.getpid()}已启动({engine}), 端口号:{port}")
+    try:
+        if engine == 'thread':
+            UDPServer(port, loss_rate, corruption_rate, output_dir, batch_io, reuse_port=True,
+                      idle_timeout=idle_timeout, time_wait=time_wait, ack_every=ack_every, ack_delay=ack_delay).run()
+        else:
+            run_server(port, loss_rate, corruption_rate, output_dir, reuse_port=True, ack_every=ack_every,
+                       ack_delay=ack_delay)
+    except KeyboardInterrupt:
+        pass
+
+
+class ServerSupervisor:
+    '''启动N个工作进程共享同一端口, 工作进程意外退出时自动重启'''
+
+    def __init__(self, port, workers, engine='thread', loss_rate=0.2, corruption_rate=0.05, output_dir=None,
+                 batch_io=True, check_interval=0.5, max_restart_delay=30.0, idle_timeout=IDLE_TIMEOUT,
+                 time_wait=TIME_WAIT, ack_every=1, ack_delay=ACK_DELAY):
+        self.port = port
+        self.workers = workers
+        self.engine = engine
+        self.loss_rate = loss_rate
+        self.corruption_rate = corruption_rate
+        self.output_dir = output_dir
+        self.batch_io = batch_io
+        self.idle_timeout = idle_timeout  # 连接表参数, 只对线程版有效
+        self.time_wait = time_wait
+        self.ack_every = ack_every
+        self.ack_delay = ack_delay
+        self.check_interval = check_interval
+        self.max_restart_delay = max_restart_delay
+
+        self.processes = [None] * workers
+        self.started_at = [0.0] * workers
+        self.restart_delay = [0.0] * workers  # 频繁崩溃时逐步退避, 避免疯狂重启
+        self.next_start = [0.0] * workers
+        self.running = False
+
+    def start_worker(self, index):
+        p = multiprocessing.Process(target=worker_main, name=f"udp-worker-{index}",
+                                    args=(self.engine, self.port, self.loss_rate, self.corruption_rate,
+                                          self.output_dir, self.batch_io, self.idle_timeout, self.time_wait,
+                                          self.ack_every, self.ack_delay))
+        p.daemon = True
+        p.start()
+        self.processes[index] = p
+        self.started_at[index] = time.time()
+
+    def check_workers(self):
+        now = time.time()
+        for index, p in enumerate(self.processes):
+            if p is not None and p.is_alive():
+                # 稳定运行一段时间后清零退避
+                if self.restart_delay[index] and now - self.started_at[index] > self.max_restart_delay:
+                    self.restart_delay[index] = 0.0
+                continue
+            if p is not None:
+                print(f"工作进程{index}(pid {p.pid})退出, 退出码{p.exitcode}")
+                p.join()
+                self.processes[index] = None
+                self.restart_delay[index] = min(self.max_restart_delay, max(0.5, self.restart_delay[index] * 2))
+                self.next_start[index] = now + self.restart_delay[index]
+                print(f"{self.restart_delay[index]:.1f}秒后重启工作进程{index}")
+            elif now >= self.next_start[index]:
+                self.start_worker(index)
+
+    def stop(self, *args):
+        self.running = False
+
+    def run(self):
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            print("当前系统不支持 SO_REUSEPORT, 无法启动多进程服务器")
+            return
+        signal.signal(signal.SIGTERM, self.stop)
+        print(f"UDP 服务器启动, 端口: {self.port}, 工作进程数: {self.workers}, 引擎: {self.engine}")
+        self.running = True
+        for index in range(self.workers):
+            self.start_worker(index)
+        try:
+            while self.running:
+                time.sleep(self.check_interval)
+                if self.running:
+                    self.check_workers()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            print("\n服务器关闭中...")
+            for p in self.processes:
+                if p is not None and p.is_alive():
+                    p.terminate()
+            for p in self.processes:
+                if p is not None:
+                    p.join()
+
+
+if __name__ == '__main__':
+    parser = build_parser("多进程 UDP 服务器, 各进程通过 SO_REUSEPORT 共享端口, 同一客户端地址固定由一个进程处理",
+                          'udpservercluster.py')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="工作进程数, 默认等于CPU核数")
+    parser.add_argument('--engine', choices=['thread', 'async'], default='thread',
+                        help="工作进程内的服务器实现: thread 每个客户端一个线程, async 单事件循环")
+    args = parse_args(parser)
+    if args.workers <= 0:
+        parser.error("workers 必须是正整数!")
+    ServerSupervisor(args.port, args.workers, args.engine, args.loss_rate, args.corruption_rate, args.output_dir,
+                     not args.no_batch, idle_timeout=args.idle_timeout, time_wait=args.time_wait,
+                     ack_every=args.ack_every, ack_delay=args.ack_delay).run()